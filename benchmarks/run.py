@@ -0,0 +1,176 @@
+# coding=utf-8
+"""
+Benchmarks of ApiStorage against the local Swift stand-in server.
+
+    python -m benchmarks.run [--latency 0.005] [--error-rate 0] [workload ...]
+
+The server runs in this process, each workload runs in a child process so
+its peak RSS is measured on its own.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORKLOADS = ("small", "large", "gzip", "concurrent")
+
+
+def setup_django(storage_url, auth_url, use_gz):
+    from django.conf import settings
+
+    settings.configure(SELECTEL_STORAGE={
+        "USER": "bench",
+        "PASSWORD": "bench",
+        "AUTH_URL": auth_url,
+        "STORAGE_URL": storage_url,
+        "USE_GZ": use_gz,
+        "OVERWRITE_FILES": True,
+        "API_POOL_MAXSIZE": 32
+    })
+    import django
+    django.setup()
+
+
+def peak_rss_mb():
+    # ru_maxrss survives exec on Linux and would include the forked server, VmHWM does not
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2.0 ** 20 if sys.platform == "darwin" else max_rss / 1024.0
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def read(storage, name):
+    with storage.open(name) as fh:
+        return fh.read()
+
+
+def timed(fn, *args):
+    started = time.time()
+    fn(*args)
+    return time.time() - started
+
+
+def run_small(storage, count=200, size=4 * 1024):
+    from django.core.files.base import ContentFile
+
+    data = os.urandom(size)
+    latencies = []
+    for i in range(count):
+        name = "bench/small/{}.bin".format(i)
+        latencies.append(timed(storage.save, name, ContentFile(data)))
+        latencies.append(timed(storage.exists, name))
+        latencies.append(timed(read, storage, name))
+    return latencies, count * size * 2
+
+
+def run_large(storage, size=64 * 2 ** 20):
+    from django.core.files import File
+
+    path = "/tmp/selectel_bench_large.bin"
+    with open(path, "wb") as fh:
+        for i in range(size // 2 ** 20):
+            fh.write(os.urandom(2 ** 20))
+    try:
+        with open(path, "rb") as fh:
+            latencies = [timed(storage.save, "bench/large.bin", File(fh))]
+        with storage.open("bench/large.bin") as fileobj:
+            latencies.append(timed(lambda: [None for _ in fileobj.chunks(2 ** 20)]))
+    finally:
+        os.remove(path)
+    return latencies, size * 2
+
+
+def run_concurrent(storage, count=400, size=16 * 1024, workers=16):
+    from django.core.files.base import ContentFile
+
+    data = os.urandom(size)
+
+    def work(i):
+        name = "bench/concurrent/{}.bin".format(i)
+        return timed(storage.save, name, ContentFile(data)) + timed(read, storage, name)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        latencies = list(executor.map(work, range(count)))
+    return latencies, count * size * 2
+
+
+def run_workload(workload, storage_url, auth_url):
+    setup_django(storage_url, auth_url, use_gz=workload == "gzip")
+    from django_selectel.storages import ApiStorage
+
+    storage = ApiStorage()
+    started = time.time()
+    if workload == "small":
+        latencies, transferred = run_small(storage)
+    elif workload == "gzip":
+        latencies, transferred = run_small(storage, count=100, size=256 * 1024)
+    elif workload == "large":
+        latencies, transferred = run_large(storage)
+    else:
+        latencies, transferred = run_concurrent(storage)
+    duration = time.time() - started
+    return {
+        "workload": workload,
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / duration,
+        "mb_per_sec": transferred / duration / 2 ** 20,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("workloads", nargs="*", help="any of {}, all by default".format(", ".join(WORKLOADS)))
+    parser.add_argument("--latency", type=float, default=0, help="latency of each request in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests failed with a 503")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON lines")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    for workload in args.workloads:
+        if workload not in WORKLOADS:
+            parser.error("unknown workload {}".format(workload))
+    args.workloads = args.workloads or WORKLOADS
+
+    if args.child:
+        print(json.dumps(run_workload(*args.child)))
+        return
+
+    from django_selectel.testing import SwiftStandInServer
+
+    with SwiftStandInServer(latency=args.latency, error_rate=args.error_rate) as server:
+        if not args.json:
+            print("{:<12}{:>8}{:>12}{:>10}{:>10}{:>10}{:>10}".format(
+                "workload", "ops", "ops/sec", "MB/sec", "p50 ms", "p99 ms", "RSS MB"))
+        for workload in args.workloads:
+            output = subprocess.check_output([
+                sys.executable, "-m", "benchmarks.run", "--child", workload, server.storage_url, server.auth_url
+            ])
+            result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+            server.objects.clear()
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print("{workload:<12}{ops:>8}{ops_per_sec:>12.1f}{mb_per_sec:>10.1f}{p50_ms:>10.2f}"
+                      "{p99_ms:>10.2f}{peak_rss_mb:>10.1f}".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+# coding=utf-8
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from functools import wraps
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from django_selectel import cache, retry, utils
+from django_selectel.api import SelectelCDNApiException
+
+
+def update_expired_token(fn):
+    @wraps(fn)
+    async def wrapper(self, *args, **kwargs):
+        if self.is_token_expire:
+            await self.authenticate()
+        token = self._token
+        try:
+            return await fn(self, *args, **kwargs)
+        except SelectelCDNApiException as e:
+            if e.response is not None and e.response.status == 401:
+                await self.authenticate(stale_token=token)
+                return await fn(self, *args, **kwargs)
+            raise
+
+    return wrapper
+
+
+def attempts(safe=True):
+    # the same retry policy as the synchronous client, see SelectelCDNApi.attempts
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            policy = self.retry_policy
+            if not policy.start():
+                raise SelectelCDNApiException("Circuit breaker is open after repeated errors")
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    result = await fn(self, *args, **kwargs)
+                except (aiohttp.ClientError, asyncio.TimeoutError, SelectelCDNApiException) as e:
+                    if not policy.failed(e, attempt, safe=safe):
+                        raise
+                    self.logger.info("Retrying %s after error: %s", fn.__name__, e)
+                    await asyncio.sleep(policy.delay(attempt))
+                else:
+                    policy.succeeded()
+                    return result
+
+        return wrapper
+
+    return decorator
+
+
+async def gather_limited(aws, limit):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=True)
+
+
+class AsyncSelectelCDNApi(object):
+
+    def __init__(self, user, password, auth_url, threshold=None, max_retry=None, retry_delay=None, chunk_size=None,
+                 metadata_cache=None, put_verify="etag", pool_size=100, concurrency=32, retry_policy=None):
+        if aiohttp is None:
+            raise ImportError("AsyncSelectelCDNApi requires aiohttp")
+        self.user = user
+        self.password = password
+        self.auth_url = auth_url
+        self.threshold = threshold or 0
+        self.max_retry = max_retry
+        self.retry_delay = retry_delay or 0
+        self.retry_policy = retry_policy or retry.RetryPolicy(max_attempts=max_retry, backoff=retry_delay)
+        self.chunk_size = chunk_size or 2 ** 20
+        self.metadata_cache = metadata_cache
+        self.put_verify = put_verify
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+
+        self._token = None
+        self._token_expire_dt = None
+        self._storage_url = None
+        self._session = None
+        self._auth_lock = None
+        self.logger = logging.getLogger("SelectelApi")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            # the storage decodes files by their Content-Encoding itself
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size), auto_decompress=False, timeout=self._timeout()
+            )
+        return self._session
+
+    def _timeout(self):
+        # the timeout of requests, a number or a (connect, read) pair, applies to each read, not the whole body
+        timeout = self.retry_policy.timeout
+        connect, read = timeout if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+        return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+    @property
+    def is_token_expire(self):
+        if not self._token_expire_dt:
+            return True
+
+        return (self._token_expire_dt - datetime.now()).total_seconds() < self.threshold
+
+    def _url(self, container, path):
+        return os.path.join(self._storage_url, container, path)
+
+    def _headers(self, headers=None):
+        headers = dict(headers or {})
+        headers["X-Auth-Token"] = self._token
+        return headers
+
+    def _cache_key(self, container, path):
+        return "{}/{}".format(container, path)
+
+    def _cache_set(self, container, path, metadata):
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(self._cache_key(container, path), metadata)
+
+    def _cache_delete(self, container, path):
+        if self.metadata_cache is not None:
+            self.metadata_cache.delete(self._cache_key(container, path))
+
+    async def authenticate(self, stale_token=None):
+        if not self.user or not self.password:
+            raise SelectelCDNApiException("Not set user or password")
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            # another task has already refreshed the token while this one was waiting
+            if self._token is not None and self._token != stale_token and not self.is_token_expire:
+                return
+            headers = {
+                "X-Auth-User": self.user,
+                "X-Auth-Key": self.password
+            }
+            async with self.session.get(self.auth_url, headers=headers) as r:
+                if r.status != 204:
+                    raise SelectelCDNApiException("Authenticate error ({})".format(r.status))
+                self._token_expire_dt = datetime.now() + timedelta(seconds=int(r.headers['X-Expire-Auth-Token']))
+                self._storage_url = r.headers['X-Storage-Url'][:-1]
+                self._token = r.headers['X-Auth-Token']
+
+    @attempts()
+    @update_expired_token
+    async def get(self, container, path, headers=None):
+        url = self._url(container, path)
+        async with self.session.get(url, headers=self._headers(headers)) as r:
+            self.logger.info("Request GET %s - %s", url, r.status)
+            if r.status >= 400:
+                raise SelectelCDNApiException("Error get file {}: {}".format(url, r.status), response=r)
+            return await r.read()
+
+    async def get_steam(self, container, path, headers=None, chunk=2 ** 20):
+        response_headers, chunks = await self.get_response_stream(container, path, headers=headers, chunk=chunk)
+        return chunks
+
+    @attempts()
+    @update_expired_token
+    async def get_response_stream(self, container, path, headers=None, chunk=2 ** 20):
+        url = self._url(container, path)
+        r = await self.session.get(url, headers=self._headers(headers))
+        self.logger.info("Request GET_STEAM %s - %s", url, r.status)
+        if r.status >= 400:
+            r.release()
+            raise SelectelCDNApiException("Error get file {}: {}".format(url, r.status), response=r)
+
+        async def iter_content():
+            try:
+                async for data in r.content.iter_chunked(chunk):
+                    yield data
+            finally:
+                r.release()
+
+        return r.headers, iter_content()
+
+    @attempts()
+    @update_expired_token
+    async def remove(self, container, path, force=False):
+        url = self._url(container, path)
+        async with self.session.delete(url, headers=self._headers()) as r:
+            self.logger.info("Request REMOVE %s - %s", url, r.status)
+            if r.status in (204, 404):
+                self._cache_set(container, path, None)
+            if r.status >= 400 and r.status != 404:
+                raise SelectelCDNApiException("Error remove file {}: {}".format(url, r.status), response=r)
+            return r.headers
+
+    async def put(self, container, path, content, headers=None):
+        # content is bytes, a file object or a callable returning the chunks anew for each attempt,
+        # an async iterator is consumed by the first attempt and is never sent again
+        if hasattr(content, '__aiter__'):
+            if self.is_token_expire:
+                await self.authenticate()
+            return await self._send_put(container, path, content, headers)
+        return await self._put(container, path, content, headers)
+
+    @attempts(safe=False)
+    @update_expired_token
+    async def _put(self, container, path, content, headers=None):
+        if callable(content):
+            content = content()
+        return await self._send_put(container, path, content, headers)
+
+    async def _send_put(self, container, path, content, headers=None):
+        url = self._url(container, path)
+        headers = self._headers(headers)
+        md5 = hashlib.md5()
+        if hasattr(content, '__aiter__'):
+            data = self._aiter_hashed(content, md5)
+        elif hasattr(content, 'read'):
+            utils.rewind(content)
+            data = self._aiter_hashed(utils.iter_chunks(content, self.chunk_size), md5)
+        else:
+            data = utils.to_bytes(content)
+            md5.update(data)
+            headers["ETag"] = md5.hexdigest()
+        async with self.session.put(url, data=data, headers=headers) as r:
+            self.logger.info("Request PUT %s - %s", url, r.status)
+            self._cache_delete(container, path)
+            if r.status != 201:
+                raise SelectelCDNApiException("Error create file {}: {}".format(url, r.status), response=r)
+            etag = r.headers.get('ETag')
+        if self.put_verify == "etag":
+            if etag and etag.strip('"') != md5.hexdigest():
+                raise SelectelCDNApiException("Checksum mismatch after PUT {}".format(url))
+        elif self.put_verify == "head":
+            if not await self.exist(container, path):
+                raise SelectelCDNApiException("Error checking file exist after PUT {}".format(url))
+        return md5.hexdigest()
+
+    async def _aiter_hashed(self, chunks, md5):
+        if hasattr(chunks, '__aiter__'):
+            async for chunk in chunks:
+                chunk = utils.to_bytes(chunk)
+                md5.update(chunk)
+                yield chunk
+        else:
+            for chunk in chunks:
+                md5.update(chunk)
+                yield chunk
+
+    async def head(self, container, path, refresh=False):
+        if self.metadata_cache is not None and not refresh:
+            metadata = self.metadata_cache.get(self._cache_key(container, path))
+            if metadata is not cache.MISSING:
+                return metadata
+        metadata = await self._head(container, path)
+        self._cache_set(container, path, metadata)
+        return metadata
+
+    @attempts()
+    @update_expired_token
+    async def _head(self, container, path):
+        url = self._url(container, path)
+        async with self.session.head(url, headers=self._headers()) as r:
+            self.logger.info("Request HEAD %s - %s", url, r.status)
+            if r.status == 404:
+                return None
+            if r.status >= 400:
+                raise SelectelCDNApiException("Error head file {}: {}".format(url, r.status), response=r)
+            return utils.object_metadata(r.headers)
+
+    async def exist(self, container, path):
+        return await self.head(container, path) is not None
+
+    async def size(self, container, path):
+        metadata = await self.head(container, path)
+        if metadata is None:
+            raise SelectelCDNApiException("file {} not exists".format(os.path.sep.join([container, path])))
+        return metadata["size"]
+
+    async def gather(self, aws, limit=None):
+        return await gather_limited(aws, limit or self.concurrency)
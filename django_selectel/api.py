@@ -2,16 +2,31 @@
 from __future__ import unicode_literals
 
 import hashlib
+import hmac
+import io
+import json
 import logging
+import mmap
 import os
+import socket
+import threading
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
 from functools import wraps
 
 import requests
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
 
-from django_selectel import utils
+try:
+    from urllib.parse import quote, unquote, urlparse
+except ImportError:
+    from urllib import quote, unquote
+    from urlparse import urlparse
+
+from django_selectel import cache, metrics, retry, streams, utils
 
 
 class SelectelCDNApiException(Exception):
@@ -22,51 +37,222 @@ class SelectelCDNApiException(Exception):
         super(SelectelCDNApiException, self).__init__(message)
 
 
+class KeepAliveAdapter(HTTPAdapter):
+
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super(KeepAliveAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs["socket_options"] = self.socket_options
+        super(KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+
+
 class SelectelCDNApi(object):
 
-    def __init__(self, user, password, auth_url, threshold=None, max_retry=None, retry_delay=None):
+    def __init__(self, user, password, auth_url, threshold=None, max_retry=None, retry_delay=None, chunk_size=None,
+                 metadata_cache=None, put_verify="etag", bulk_delete_size=1000, delete_workers=8,
+                 pool_connections=10, pool_maxsize=10, pool_block=False, tcp_keepalive=True, token_store=None,
+                 storage_url=None, hooks=None, retry_policy=None, prefetch_ttl=60):
         self.user = user
         self.password = password
         self.auth_url = auth_url
         self.threshold = threshold or 0
         self.max_retry = max_retry
         self.retry_delay = retry_delay
+        self.retry_policy = retry_policy or retry.RetryPolicy(max_attempts=max_retry, backoff=retry_delay)
+        self.chunk_size = chunk_size or 2 ** 20
+        self.segments_prefix = ".segments"
+        self.metadata_cache = metadata_cache
+        # without a metadata cache keeps only the metadata requested by head_many
+        self._prefetched = cache.MetadataCache(ttl=prefetch_ttl) if metadata_cache is None else None
+        self.put_verify = put_verify
+        self.token_store = token_store
+        self.bulk_delete_size = bulk_delete_size
+        self.delete_workers = delete_workers
+        self._bulk_delete_supported = None
+        self.hooks = list(hooks or [])
+        self._events = threading.local()
+        self._hedge_executor = None
 
+        self._token = None
         self._token_expire_dt = None
-        self._storage_url = None
-        self._session = None
+        self._storage_url = storage_url.rstrip('/') if storage_url else None
+        self._auth_lock = threading.Lock()
+        self._pool_maxsize = pool_maxsize
+        self._session = self._create_session(pool_connections, pool_maxsize, pool_block, tcp_keepalive)
         self.logger = logging.getLogger("SelectelApi")
 
+    def _create_session(self, pool_connections, pool_maxsize, pool_block, tcp_keepalive):
+        socket_options = None
+        if tcp_keepalive:
+            socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        adapter = KeepAliveAdapter(
+            socket_options=socket_options,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def instrumented(operation, scope="object"):
+        # scope tells how many leading arguments name the target: container and path, container or nothing
+        target_args = {"object": 2, "container": 1}.get(scope, 0)
+
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(self, *args, **kwargs):
+                event = metrics.RequestEvent(operation, *args[:target_args])
+                self._emit("on_start", event)
+                stack = getattr(self._events, "stack", None)
+                if stack is None:
+                    stack = self._events.stack = []
+                stack.append(event)
+                error = None
+                try:
+                    return fn(self, *args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    stack.pop()
+                    event.finish(error=error)
+                    self.logger.debug(
+                        "%s %s/%s - %s, %s bytes, %.3fs, %s retries, %s auth refreshes", event.operation,
+                        event.container, event.path, event.status, event.bytes, event.duration, event.retries,
+                        event.auth_refreshes
+                    )
+                    self._emit("on_end", event)
+
+            return wrapper
+
+        return decorator
+
     def update_expired_token(fn):
         @wraps(fn)
         def wrapper(self, *args, **kwargs):
             if self.is_token_expire:
+                self._count_auth_refresh()
                 self.authenticate()
+            token = self._token
             try:
                 return fn(self, *args, **kwargs)
             except (requests.exceptions.HTTPError, SelectelCDNApiException) as e:
-                if e.response.status_code == 401:
-                    self.authenticate()
+                if e.response is not None and e.response.status_code == 401:
+                    self._count_auth_refresh()
+                    self.authenticate(stale_token=token)
                     return fn(self, *args, **kwargs)
                 else:
                     raise e
 
         return wrapper
 
-    def attempts(fn):
-        @wraps(fn)
-        def wrapper(self, *args, **kwargs):
-            if self.max_retry is not None:
-                retries = self.max_retry
-                while retries > 1:
+    def attempts(safe=True, hedged=False):
+        # safe requests have no body and may be sent again after any retryable error,
+        # hedged ones are also duplicated when the answer takes longer than usual
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(self, *args, **kwargs):
+                policy = self.retry_policy
+                if not policy.start():
+                    raise SelectelCDNApiException("Circuit breaker is open after repeated errors")
+                attempt = 0
+                while True:
+                    attempt += 1
                     try:
-                        return fn(self, *args, **kwargs)
-                    except (requests.exceptions.HTTPError, SelectelCDNApiException):
-                        retries -= 1
-                        time.sleep(self.retry_delay)
-            return fn(self, *args, **kwargs)
+                        if hedged:
+                            result = self._hedged(fn, *args, **kwargs)
+                        else:
+                            result = fn(self, *args, **kwargs)
+                    except (requests.exceptions.RequestException, SelectelCDNApiException) as e:
+                        if not policy.failed(e, attempt, safe=safe):
+                            raise
+                        self.logger.info("Retrying %s after error: %s", fn.__name__, e)
+                        event = self._current_event()
+                        if event is not None:
+                            event.retries += 1
+                        time.sleep(policy.delay(attempt))
+                    else:
+                        policy.succeeded()
+                        return result
 
-        return wrapper
+            return wrapper
+
+        return decorator
+
+    def _current_event(self):
+        stack = getattr(self._events, "stack", None)
+        return stack[-1] if stack else None
+
+    def _emit(self, name, event):
+        for hook in self.hooks:
+            try:
+                getattr(hook, name)(event)
+            except Exception:
+                self.logger.exception("Metrics hook %r failed", hook)
+
+    def _count_auth_refresh(self):
+        event = self._current_event()
+        if event is not None:
+            event.auth_refreshes += 1
+
+    def _track(self, response, size=None):
+        event = self._current_event()
+        if event is None:
+            return
+        event.status = response.status_code
+        if size is None:
+            size = int(response.headers.get("Content-Length") or 0)
+        event.bytes += size
+
+    def _hedged(self, fn, *args, **kwargs):
+        policy = self.retry_policy
+        delay = policy.hedge_delay(fn.__name__)
+        if delay is None:
+            started = metrics.clock()
+            result = fn(self, *args, **kwargs)
+            policy.observe(fn.__name__, metrics.clock() - started)
+            return result
+
+        event = self._current_event()
+
+        def call():
+            # the worker thread reports to the event of the calling thread
+            self._events.stack = [event] if event is not None else []
+            started = metrics.clock()
+            try:
+                result = fn(self, *args, **kwargs)
+                policy.observe(fn.__name__, metrics.clock() - started)
+                return result
+            finally:
+                self._events.stack = []
+
+        with self._auth_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=self._pool_maxsize)
+        pending = {self._hedge_executor.submit(call)}
+        done, _ = wait(pending, timeout=delay)
+        if not done and policy.budget.withdraw():
+            self.logger.info("Hedging %s after %.3fs", fn.__name__, delay)
+            pending.add(self._hedge_executor.submit(call))
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not pending:
+                return done.pop().result()
+
+    def _iter_tracked(self, chunks):
+        event = self._current_event()
+        for chunk in chunks:
+            if event is not None:
+                event.bytes += len(chunk)
+            yield chunk
 
     @property
     def is_token_expire(self):
@@ -75,117 +261,596 @@ class SelectelCDNApi(object):
 
         return (self._token_expire_dt - datetime.now()).total_seconds() < self.threshold
 
-    @update_expired_token
+    def _cache_key(self, container, path):
+        return "{}/{}".format(container, path)
+
+    def _cache_set(self, container, path, metadata):
+        key = self._cache_key(container, path)
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(key, metadata)
+        elif self._prefetched.get(key) is not cache.MISSING:
+            self._prefetched.set(key, metadata)
+
+    def _cache_delete(self, container, path):
+        if self.metadata_cache is not None:
+            self.metadata_cache.delete(self._cache_key(container, path))
+        else:
+            self._prefetched.delete(self._cache_key(container, path))
+
     def get_url(self, container, path):
+        # the storage URL does not change, a token is only needed if it is not known yet
+        if self._storage_url is None:
+            self.authenticate()
         return os.path.join(self._storage_url, container, path)
 
-    def authenticate(self):
+    def get_temp_url(self, container, path, key, expires, method="GET"):
+        url = self.get_url(container, path)
+        url_path = urlparse(url).path
+        expires = int(expires)
+        body = "{}\n{}\n{}".format(method, expires, url_path)
+        signature = hmac.new(utils.to_bytes(key), utils.to_bytes(body), hashlib.sha1).hexdigest()
+        return "{}{}?temp_url_sig={}&temp_url_expires={}".format(
+            url[:-len(url_path)] if url_path else url, quote(utils.to_bytes(url_path)), signature, expires
+        )
+
+    def get_form_post(self, container, prefix, key, expires, max_file_size, max_file_count=1, redirect=""):
+        url = self.get_url(container, prefix)
+        expires = int(expires)
+        body = "{}\n{}\n{}\n{}\n{}".format(urlparse(url).path, redirect, max_file_size, max_file_count, expires)
+        return {
+            "url": url,
+            "fields": {
+                "redirect": redirect,
+                "max_file_size": max_file_size,
+                "max_file_count": max_file_count,
+                "expires": expires,
+                "signature": hmac.new(utils.to_bytes(key), utils.to_bytes(body), hashlib.sha1).hexdigest()
+            }
+        }
+
+    def authenticate(self, stale_token=None):
         if not self.user or not self.password:
             raise SelectelCDNApiException("Not set user or password")
+        with self._auth_lock:
+            # another thread has already refreshed the token while this one was waiting
+            if self._token is not None and self._token != stale_token and not self.is_token_expire:
+                return
+            if self.token_store is None:
+                self._set_token(self._request_token())
+                return
+            if self._use_stored_token(stale_token):
+                return
+            with self.token_store.lock(self.user):
+                # another process may have refreshed the token while this one was waiting
+                if self._use_stored_token(stale_token):
+                    return
+                data = self._request_token()
+                self.token_store.set(self.user, data)
+                self._set_token(data)
+
+    def _use_stored_token(self, stale_token):
+        data = self.token_store.get(self.user)
+        if not data or data["token"] == stale_token or data["expires"] - time.time() < self.threshold:
+            return False
+        self._set_token(data)
+        return True
+
+    def _request_token(self):
         headers = {
             "X-Auth-User": self.user,
-            "X-Auth-Key": self.password
+            "X-Auth-Key": self.password,
+            "X-Auth-Token": None
         }
-        r = requests.get(self.auth_url, headers=headers, verify=True)
+        r = self._session.get(self.auth_url, headers=headers, verify=True, timeout=self.retry_policy.timeout)
         if r.status_code != 204:
             raise SelectelCDNApiException("Authenticate error ({})".format(r.status_code))
+        return {
+            "token": r.headers['X-Auth-Token'],
+            "storage_url": r.headers['X-Storage-Url'][:-1],
+            "expires": time.time() + int(r.headers['X-Expire-Auth-Token'])
+        }
 
-        self._token_expire_dt = datetime.now() + timedelta(seconds=int(r.headers['X-Expire-Auth-Token']))
-        self._storage_url = r.headers['X-Storage-Url'][:-1]
-
-        self._session = requests.Session()
-        self._session.headers.update({
-            "X-Auth-Token": r.headers['X-Auth-Token']
-        })
+    def _set_token(self, data):
+        self._storage_url = data["storage_url"]
+        self._token = data["token"]
+        self._session.headers["X-Auth-Token"] = self._token
+        self._token_expire_dt = datetime.fromtimestamp(data["expires"])
 
-    @attempts
+    @instrumented("get")
+    @attempts(hedged=True)
     @update_expired_token
     def get(self, container, path, headers=None):
         url = os.path.join(self._storage_url, container, path)
         if headers is None:
             headers = {}
-        response = self._session.get(url, headers=headers, verify=True)
+        response = self._session.get(url, headers=headers, verify=True, timeout=self.retry_policy.timeout)
 
-        self.logger.info("Request GET {} - {}".format(url, response.status_code))
+        self.logger.info("Request GET %s - %s", url, response.status_code)
+        self._track(response, size=len(response.content))
         try:
             response.raise_for_status()
         except HTTPError as e:
             raise SelectelCDNApiException("Error get file {}: {}".format(url, str(e)), response=response)
         return response.content
 
-    @attempts
+    @instrumented("get")
+    @attempts()
     @update_expired_token
-    def get_steam(self, container, path, headers=None, chunk=2 ** 20):
+    def get_response(self, container, path, headers=None):
         url = os.path.join(self._storage_url, container, path)
         if headers is None:
             headers = {}
-        r = self._session.get(url, headers=headers, stream=True, verify=True)
-        self.logger.info("Request GET_STEAM {} - {}".format(url, r.status_code))
+        r = self._session.get(url, headers=headers, stream=True, verify=True, timeout=self.retry_policy.timeout)
+        self.logger.info("Request GET_STEAM %s - %s", url, r.status_code)
+        self._track(r)
         try:
             r.raise_for_status()
         except HTTPError as e:
             raise SelectelCDNApiException("Error get file {}: {}".format(url, str(e)), response=r)
-        return r.iter_content(chunk_size=chunk)
+        return r
 
-    @attempts
+    def get_steam(self, container, path, headers=None, chunk=2 ** 20):
+        return self.get_response(container, path, headers=headers).iter_content(chunk_size=chunk)
+
+    @instrumented("get_range")
+    @attempts(hedged=True)
     @update_expired_token
-    def remove(self, container, path, force=False):
+    def get_range(self, container, path, start, end=None):
         url = os.path.join(self._storage_url, container, path)
-        r = self._session.delete(url, verify=True)
-        self.logger.info("Request REMOVE {} - {}".format(url, r.status_code))
+        headers = {"Range": "bytes={}-{}".format(start, "" if end is None else end)}
+        r = self._session.get(url, headers=headers, verify=True, timeout=self.retry_policy.timeout)
+        self.logger.info("Request GET_RANGE %s %s - %s", url, headers["Range"], r.status_code)
+        self._track(r, size=len(r.content))
+        if r.status_code == 416:
+            return b'', start, utils.parse_content_range(r.headers['Content-Range'])[2]
+        try:
+            r.raise_for_status()
+        except HTTPError as e:
+            raise SelectelCDNApiException("Error get file {}: {}".format(url, str(e)), response=r)
+        if r.status_code == 206:
+            first, last, total = utils.parse_content_range(r.headers['Content-Range'])
+            return r.content, first, total
+        return r.content, 0, len(r.content)
+
+    @instrumented("delete")
+    @attempts()
+    @update_expired_token
+    def remove(self, container, path, force=False, multipart=False):
+        # multipart deletes a static large object together with its segments
+        url = os.path.join(self._storage_url, container, path)
+        params = {"multipart-manifest": "delete"} if multipart else None
+        r = self._session.delete(url, params=params, verify=True, timeout=self.retry_policy.timeout)
+        self.logger.info("Request REMOVE %s - %s", url, r.status_code)
+        self._track(r, size=0)
+        if r.status_code in (200, 204, 404):
+            self._cache_set(container, path, None)
         if force:
             if r.status_code == 404:
                 return r.headers
         try:
             r.raise_for_status()
-            assert r.status_code == 204
+            assert r.status_code in (200, 204)
         except HTTPError as e:
             if e.response.status_code != 404:
                 raise SelectelCDNApiException("Error remove file {}: {}".format(url, str(e)), response=r)
         return r.headers
 
-    @attempts
+    def remove_large_object(self, container, path, force=False):
+        # a plain DELETE of a large object manifest leaves its segments behind
+        metadata = self.head(container, path, refresh=True)
+        if metadata is None or not metadata["large_object"]:
+            return self.remove(container, path, force=force)
+        if not metadata.get("manifest"):
+            return self.remove(container, path, force=force, multipart=True)
+        segments = self.large_object_segments(container, path, metadata)
+        headers = self.remove(container, path, force=force)
+        self.delete_many(segments)
+        return headers
+
+    def large_object_segments(self, container, path, metadata):
+        # (container, path) of the segments of a large object, metadata is returned by head()
+        if metadata.get("manifest"):
+            segments_container, _, prefix = metadata["manifest"].partition("/")
+            return [
+                (segments_container, entry["name"])
+                for entry in self.list_container(segments_container, prefix=prefix) if "name" in entry
+            ]
+        return [
+            tuple(segment["name"].lstrip("/").split("/", 1)) for segment in self.get_manifest(container, path)
+        ]
+
+    @instrumented("get_manifest")
+    @attempts()
+    @update_expired_token
+    def get_manifest(self, container, path):
+        url = os.path.join(self._storage_url, container, path)
+        r = self._session.get(url, params={"multipart-manifest": "get"}, verify=True,
+                              timeout=self.retry_policy.timeout)
+        self.logger.info("Request GET_MANIFEST %s - %s", url, r.status_code)
+        self._track(r)
+        try:
+            r.raise_for_status()
+            return r.json()
+        except (HTTPError, ValueError) as e:
+            raise SelectelCDNApiException("Error get manifest {}: {}".format(url, str(e)), response=r)
+
+    def delete_many(self, objects):
+        objects = list(objects)
+        results = {}
+        for start in range(0, len(objects), self.bulk_delete_size):
+            batch = objects[start:start + self.bulk_delete_size]
+            if self._bulk_delete_supported is not False:
+                batch_results = self.bulk_delete(batch)
+                if batch_results is not None:
+                    results.update(batch_results)
+                    continue
+            results.update(self._delete_concurrently(batch))
+        return results
+
+    @instrumented("bulk_delete", scope="account")
+    @attempts(safe=False)
+    @update_expired_token
+    def bulk_delete(self, objects):
+        body = "\n".join(
+            quote(utils.to_bytes("/{}/{}".format(container, path))) for container, path in objects
+        ).encode('utf-8')
+        r = self._session.post(
+            self._storage_url + "/",
+            params={"bulk-delete": "true"},
+            data=body,
+            headers={"Content-Type": "text/plain", "Accept": "application/json"},
+            verify=True,
+            timeout=self.retry_policy.timeout
+        )
+        self.logger.info("Request BULK_DELETE %s objects - %s", len(objects), r.status_code)
+        self._track(r, size=len(body))
+        if r.status_code in (400, 404, 405, 501) and self._bulk_delete_supported is None:
+            # the bulk middleware is not enabled
+            self._bulk_delete_supported = False
+            return None
+        try:
+            r.raise_for_status()
+            report = r.json()
+        except (HTTPError, ValueError) as e:
+            raise SelectelCDNApiException("Error bulk delete: {}".format(str(e)), response=r)
+        self._bulk_delete_supported = True
+
+        status = int(report.get("Response Status", "200").split()[0])
+        if status >= 400 and not report.get("Errors"):
+            raise SelectelCDNApiException("Error bulk delete: {}".format(report.get("Response Status")), response=r)
+        errors = {}
+        for error_path, error_status in report.get("Errors", []):
+            errors[unquote(error_path).lstrip("/")] = int(error_status.split()[0])
+        results = {}
+        for container, path in objects:
+            results[(container, path)] = errors.get("{}/{}".format(container, path), 204)
+            if results[(container, path)] in (204, 404):
+                self._cache_set(container, path, None)
+        return results
+
+    def _delete_concurrently(self, objects):
+        def delete(item):
+            container, path = item
+            try:
+                self.remove(container, path, force=True)
+            except (requests.exceptions.RequestException, SelectelCDNApiException) as e:
+                response = getattr(e, 'response', None)
+                return item, response.status_code if response is not None else 0
+            return item, 204
+
+        with ThreadPoolExecutor(max_workers=self.delete_workers) as executor:
+            return dict(executor.map(delete, objects))
+
+    @instrumented("copy")
+    @attempts()
+    @update_expired_token
+    def copy(self, src_container, src_path, dst_container, dst_path, headers=None):
+        url = os.path.join(self._storage_url, dst_container, dst_path)
+        headers = dict(headers or {})
+        headers["X-Copy-From"] = quote(utils.to_bytes("/{}/{}".format(src_container, src_path)))
+        headers["Content-Length"] = "0"
+        r = self._session.put(url, headers=headers, verify=True, timeout=self.retry_policy.timeout)
+        self.logger.info("Request COPY %s -> %s - %s", headers["X-Copy-From"], url, r.status_code)
+        self._track(r, size=0)
+        self._cache_delete(dst_container, dst_path)
+        try:
+            r.raise_for_status()
+        except HTTPError as e:
+            raise SelectelCDNApiException("Error copy file to {}: {}".format(url, str(e)), response=r)
+        return r.headers.get('ETag', '').strip('"')
+
+    def move(self, src_container, src_path, dst_container, dst_path, headers=None, segments=False):
+        # with segments the source is checked for a large object and deleted with its segments
+        etag = self.copy(src_container, src_path, dst_container, dst_path, headers=headers)
+        if segments:
+            self.remove_large_object(src_container, src_path, force=True)
+        else:
+            self.remove(src_container, src_path, force=True)
+        return etag
+
+    def copy_many(self, pairs, move=False, workers=8, segments=False):
+        def copy(pair):
+            (src_container, src_path), (dst_container, dst_path) = pair
+            try:
+                if move:
+                    self.move(src_container, src_path, dst_container, dst_path, segments=segments)
+                else:
+                    self.copy(src_container, src_path, dst_container, dst_path)
+            except (requests.exceptions.RequestException, SelectelCDNApiException) as e:
+                response = getattr(e, 'response', None)
+                return pair, response.status_code if response is not None else 0
+            return pair, 201
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(copy, pairs))
+
+    @instrumented("put")
+    @attempts(safe=False)
     @update_expired_token
     def put(self, container, path, content, headers=None):
+        return self._put(container, path, content, headers=headers)
+
+    @instrumented("put_segment")
+    @attempts()
+    @update_expired_token
+    def put_segment(self, container, path, segment):
+        # a segment is rewound and written to its own path, it is sent again after any retryable error
+        return self._put(container, path, segment)
+
+    def _put(self, container, path, content, headers=None):
         url = os.path.join(self._storage_url, container, path)
-        if headers is None:
-            headers = {}
-        if utils.is_py3():
-            etag = hashlib.md5(content.encode('utf8') if hasattr(content, 'encode') else content).hexdigest()
+        headers = dict(headers or {})
+        if hasattr(content, 'read'):
+            # file-like objects are sent with chunked transfer encoding, the MD5 is
+            # computed while the body goes out and checked against the response ETag
+            utils.rewind(content)
+            md5 = hashlib.md5()
+            data = self._iter_tracked(utils.iter_hashed(utils.iter_chunks(content, self.chunk_size), md5))
+            size = 0
         else:
-            etag = hashlib.md5(content).hexdigest()
-        headers["ETag"] = etag
-        if hasattr(content, 'encode'):
-            content = content.encode('utf-8')
-        r = self._session.put(url, data=content, headers=headers, verify=True)
-        self.logger.info("Request PUT {} - {}: {}".format(url, r.status_code, r.content))
+            data = utils.to_bytes(content)
+            md5 = hashlib.md5(data)
+            headers["ETag"] = md5.hexdigest()
+            size = len(data)
+        r = self._session.put(url, data=data, headers=headers, verify=True, timeout=self.retry_policy.timeout)
+        self.logger.info("Request PUT %s - %s", url, r.status_code)
+        self._track(r, size=size)
+        self._cache_delete(container, path)
         try:
             r.raise_for_status()
             assert r.status_code == 201
-            if not self.exist(container, path):
-                raise SelectelCDNApiException("Error checking file exist after PUT {}".format(url), response=r)
+            if self.put_verify == "etag":
+                etag = r.headers.get('ETag')
+                if etag and etag.strip('"') != md5.hexdigest():
+                    raise SelectelCDNApiException("Checksum mismatch after PUT {}".format(url), response=r)
+            elif self.put_verify == "head":
+                if not self.exist(container, path):
+                    raise SelectelCDNApiException("Error checking file exist after PUT {}".format(url), response=r)
         except HTTPError as e:
             raise SelectelCDNApiException("Error create file {}: {}".format(url, str(e)), response=r)
-        return True
+        return md5.hexdigest()
+
+    def put_segmented(self, container, path, content, size, segment_size, workers=4, manifest="static",
+                      segments_container=None, headers=None):
+        segments_container = segments_container or container
+        prefix = "{}/{}/{:.6f}/{}".format(self.segments_prefix, path, time.time(), segment_size)
+        lock = threading.Lock()
+
+        def upload(index):
+            offset = index * segment_size
+            segment_path = "{}/{:08d}".format(prefix, index)
+            segment = streams.FileSegment(content, offset, min(segment_size, size - offset), lock)
+            etag = self.put_segment(segments_container, segment_path, segment)
+            return {
+                "path": "/{}/{}".format(segments_container, segment_path),
+                "etag": etag,
+                "size_bytes": min(segment_size, size - offset)
+            }
 
-    @attempts
+        count = max(1, (size + segment_size - 1) // segment_size)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                segments = list(executor.map(upload, range(count)))
+
+            if manifest == "static":
+                return self.put_manifest(container, path, segments, headers=headers)
+            headers = dict(headers or {})
+            headers["X-Object-Manifest"] = "{}/{}/".format(segments_container, prefix)
+            return self.put(container, path, b'', headers=headers)
+        except Exception:
+            # no manifest refers to the segments of a failed upload
+            try:
+                self.delete_many(
+                    (segments_container, entry["name"])
+                    for entry in self.list_container(segments_container, prefix=prefix + "/") if "name" in entry
+                )
+            except (requests.exceptions.RequestException, SelectelCDNApiException):
+                self.logger.exception("Error delete segments of a failed upload %s/%s", segments_container, prefix)
+            raise
+
+    @instrumented("put_manifest")
+    @attempts(safe=False)
     @update_expired_token
-    def exist(self, container, path):
+    def put_manifest(self, container, path, segments, headers=None):
         url = os.path.join(self._storage_url, container, path)
+        body = json.dumps(segments).encode('utf-8')
+        r = self._session.put(url, params={"multipart-manifest": "put"}, data=body, headers=headers, verify=True,
+                              timeout=self.retry_policy.timeout)
+        self.logger.info("Request PUT_MANIFEST %s - %s", url, r.status_code)
+        self._track(r, size=len(body))
+        self._cache_delete(container, path)
+        try:
+            r.raise_for_status()
+        except HTTPError as e:
+            raise SelectelCDNApiException("Error create manifest {}: {}".format(url, str(e)), response=r)
+        return r.headers.get('ETag', '').strip('"')
 
-        r = self._session.head(url)
-        self.logger.info("Request EXIST {} - {}: {}".format(url, r.status_code, r.content))
-        if r.status_code not in (200, 404):
+    @instrumented("extract_archive", scope="container")
+    @attempts(safe=False)
+    @update_expired_token
+    def extract_archive(self, container, files, prefix="", compress=False):
+        url = os.path.join(self._storage_url, container)
+        if prefix:
+            url = os.path.join(url, prefix)
+        files = list(files)
+        r = self._session.put(
+            url,
+            params={"extract-archive": "tar.gz" if compress else "tar"},
+            data=self._iter_tracked(utils.tar_chunks(self._archive_members(files), compress, self.chunk_size)),
+            headers={"Accept": "application/json"},
+            verify=True,
+            timeout=self.retry_policy.timeout
+        )
+        self.logger.info("Request EXTRACT_ARCHIVE %s %s files - %s", url, len(files), r.status_code)
+        self._track(r, size=0)
+        try:
             r.raise_for_status()
-        return r.status_code == 200
+            report = r.json()
+        except (HTTPError, ValueError) as e:
+            raise SelectelCDNApiException("Error extract archive {}: {}".format(url, str(e)), response=r)
 
-    @attempts
+        status = int(report.get("Response Status", "201").split()[0])
+        if status >= 400 and not report.get("Errors"):
+            raise SelectelCDNApiException("Error extract archive {}: {} {}".format(
+                url, report.get("Response Status"), report.get("Response Body")), response=r)
+        # the paths in the report may start with the version and the account
+        targets = dict(
+            ("/" + "/".join(part for part in (container, prefix, path) if part), path) for path, content in files
+        )
+        results = dict((path, 201) for path, content in files)
+        for error_path, error_status in report.get("Errors", []):
+            error_path = unquote(error_path)
+            for target, path in targets.items():
+                if error_path.endswith(target):
+                    results[path] = int(error_status.split()[0])
+        for path in results:
+            self._cache_delete(container, "/".join(part for part in (prefix, path) if part))
+        return results
+
+    def _archive_members(self, files):
+        for path, content in files:
+            if hasattr(content, 'read'):
+                size = getattr(content, 'size', None)
+                if size is None:
+                    content.seek(0, os.SEEK_END)
+                    size = content.tell()
+                utils.rewind(content)
+                yield path, content, size
+            else:
+                data = utils.to_bytes(content)
+                yield path, io.BytesIO(data), len(data)
+
+    def head(self, container, path, refresh=False):
+        metadata_cache = self._prefetched if self.metadata_cache is None else self.metadata_cache
+        metadata = cache.MISSING if refresh else metadata_cache.get(self._cache_key(container, path))
+        if metadata is not cache.MISSING:
+            return metadata
+        metadata = self._head(container, path)
+        self._cache_set(container, path, metadata)
+        return metadata
+
+    def head_many(self, objects, workers=16, refresh=False):
+        def head(item):
+            container, path = item
+            metadata = self.head(container, path, refresh=refresh)
+            if self.metadata_cache is None:
+                self._prefetched.set(self._cache_key(container, path), metadata)
+            return item, metadata
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(head, objects))
+
+    @instrumented("head")
+    @attempts(hedged=True)
     @update_expired_token
-    def size(self, container, path):
+    def _head(self, container, path):
         url = os.path.join(self._storage_url, container, path)
-        r = self._session.head(url)
-        self.logger.info("Request SIZE {} - {}: {}".format(url, r.status_code, r.content))
+        r = self._session.head(url, timeout=self.retry_policy.timeout)
+        self.logger.info("Request HEAD %s - %s", url, r.status_code)
+        self._track(r, size=0)
+        if r.status_code == 404:
+            return None
         r.raise_for_status()
-        if r.status_code != 200:
-            raise SelectelCDNApiException("file {} not exists".format(os.path.sep.join([container, path])), response=r)
-        return int(r.headers['Content-Length'])
+        return utils.object_metadata(r.headers)
+
+    def download(self, container, path, fileobj, workers=4, part_size=2 ** 23):
+        # always fresh: the ETag of a cached entry may come from a listing
+        metadata = self._head(container, path)
+        if metadata is None:
+            raise SelectelCDNApiException("file {} not exists".format(os.path.sep.join([container, path])))
+        size = metadata["size"]
+        fileobj.truncate(size)
+        if not size:
+            return metadata
+
+        buf = mmap.mmap(fileobj.fileno(), size)
+        try:
+            def fetch(start):
+                end = min(start + part_size, size) - 1
+                content, first, total = self.get_range(container, path, start, end)
+                if first != start or len(content) != end - start + 1:
+                    raise SelectelCDNApiException("Unexpected range {}-{} of {}/{}".format(
+                        first, first + len(content) - 1, container, path))
+                buf[start:end + 1] = content
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(fetch, range(0, size, part_size)))
+
+            if not metadata["large_object"]:
+                md5 = hashlib.md5()
+                for start in range(0, size, self.chunk_size):
+                    md5.update(buf[start:start + self.chunk_size])
+                if md5.hexdigest() != metadata["etag"]:
+                    raise SelectelCDNApiException("Checksum mismatch after download {}/{}".format(container, path))
+            buf.flush()
+        finally:
+            buf.close()
+        return metadata
+
+    def list_container(self, container, prefix=None, delimiter=None, marker=None, limit=10000):
+        while True:
+            page = self._list_page(container, prefix, delimiter, marker, limit)
+            for entry in page:
+                if "subdir" in entry:
+                    yield entry
+                    continue
+                metadata = utils.listing_metadata(entry)
+                self._cache_set(container, entry["name"], {
+                    key: value for key, value in metadata.items() if key != "name"
+                })
+                yield metadata
+            if len(page) < limit:
+                return
+            marker = page[-1].get("name", page[-1].get("subdir"))
+
+    @instrumented("list", scope="container")
+    @attempts()
+    @update_expired_token
+    def _list_page(self, container, prefix, delimiter, marker, limit):
+        url = os.path.join(self._storage_url, container)
+        params = {"format": "json", "limit": limit}
+        if prefix:
+            params["prefix"] = prefix
+        if delimiter:
+            params["delimiter"] = delimiter
+        if marker:
+            params["marker"] = marker
+        r = self._session.get(url, params=params, verify=True, timeout=self.retry_policy.timeout)
+        self.logger.info("Request LIST %s %s - %s", url, marker or "", r.status_code)
+        self._track(r)
+        try:
+            r.raise_for_status()
+        except HTTPError as e:
+            raise SelectelCDNApiException("Error list container {}: {}".format(url, str(e)), response=r)
+        if r.status_code == 204 or not r.content:
+            return []
+        return r.json()
+
+    def exist(self, container, path):
+        return self.head(container, path) is not None
+
+    def size(self, container, path):
+        metadata = self.head(container, path)
+        if metadata is None:
+            raise SelectelCDNApiException("file {} not exists".format(os.path.sep.join([container, path])))
+        return metadata["size"]
@@ -0,0 +1,208 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django_selectel import streams
+
+# returned by the caches for unknown keys, since None means "the object does not exist"
+MISSING = object()
+
+
+class MetadataCache(object):
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return MISSING
+            expire_at, value = entry
+            if expire_at is not None and expire_at < time.time():
+                return MISSING
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        expire_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expire_at, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoMetadataCache(object):
+
+    def __init__(self, alias="default", ttl=60, key_prefix="selectel:meta:"):
+        from django.core.cache import caches
+
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._cache = caches[alias]
+
+    def _key(self, key):
+        return self.key_prefix + hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self._cache.get(self._key(key), MISSING)
+
+    def set(self, key, value):
+        self._cache.set(self._key(key), value, self.ttl)
+
+    def delete(self, key):
+        self._cache.delete(self._key(key))
+
+    def clear(self):
+        self._cache.clear()
+
+
+def get_metadata_cache(options):
+    backend = options.get("BACKEND")
+    if not backend:
+        return None
+    if backend == "memory":
+        return MetadataCache(ttl=options.get("TTL", 60), max_entries=options.get("MAX_ENTRIES", 10000))
+    if backend == "django":
+        return DjangoMetadataCache(alias=options.get("ALIAS", "default"), ttl=options.get("TTL", 60))
+    from django.utils.module_loading import import_string
+    return import_string(backend)(**options.get("OPTIONS", {}))
+
+
+class DiskCache(object):
+    """
+    Read-through cache of object contents on the local disk.
+
+    Entries are revalidated with the stored ETag after `freshness` seconds
+    and the least recently used files are removed above `max_size` bytes.
+    """
+
+    def __init__(self, path, max_size=2 ** 30, freshness=0):
+        self.path = path
+        self.max_size = max_size
+        self.freshness = freshness
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _paths(self, key):
+        base = os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        return base, base + ".json"
+
+    def _read_meta(self, key):
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+        return meta if os.path.exists(data_path) else None
+
+    def _write_meta(self, key, meta):
+        meta_path = self._paths(key)[1]
+        tmp_path = "{}.{}.tmp".format(meta_path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            json.dump(meta, fh)
+        os.rename(tmp_path, meta_path)
+
+    def open(self, key, fetch):
+        """
+        `fetch(etag)` returns None if the object still has this ETag,
+        otherwise `(etag, chunks)` with the current content.
+        """
+        data_path, meta_path = self._paths(key)
+        meta = self._read_meta(key)
+        fileobj = None
+        if meta is not None and time.time() - meta["checked_at"] < self.freshness:
+            # None if another process has evicted the file meanwhile
+            fileobj = self._open_data(data_path)
+        if fileobj is None:
+            result = fetch(meta["etag"] if meta else None)
+            if result is None:
+                fileobj = self._open_data(data_path)
+                if fileobj is None:
+                    result = fetch(None)
+                else:
+                    # the modification time orders the eviction
+                    os.utime(data_path, None)
+            if result is not None:
+                etag, chunks = result
+                tmp_path = "{}.{}.{}.tmp".format(data_path, os.getpid(), threading.current_thread().ident)
+                with open(tmp_path, "wb") as fh:
+                    for chunk in chunks:
+                        fh.write(chunk)
+                # opened before the eviction of other processes can see it
+                fileobj = self._open_data(tmp_path)
+                os.rename(tmp_path, data_path)
+                meta = {"etag": etag}
+            meta["checked_at"] = time.time()
+            self._write_meta(key, meta)
+            self._evict(keep=data_path)
+        else:
+            os.utime(data_path, None)
+        return fileobj
+
+    def _open_data(self, data_path):
+        # the mapping stays readable when the file is removed afterwards
+        try:
+            if not os.path.getsize(data_path):
+                return io.BytesIO(b'')
+            return streams.MmapFile(data_path)
+        except (IOError, OSError):
+            return None
+
+    def delete(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.endswith(".json") or name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            # the file being returned stays even if it is larger than the cache
+            if path == keep:
+                continue
+            for victim in (path, path + ".json"):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+
+
+def get_disk_cache(options):
+    if not options.get("PATH"):
+        return None
+    return DiskCache(options["PATH"], max_size=options.get("MAX_SIZE", 2 ** 30), freshness=options.get("FRESHNESS", 0))
@@ -0,0 +1,192 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import mimetypes
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+from django_selectel import utils
+
+# types that are compressed already and do not shrink
+SKIP_TYPES = (
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/avif", "image/heic",
+    "video/", "audio/", "font/woff", "font/woff2",
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2", "application/x-xz",
+    "application/x-7z-compressed", "application/x-rar-compressed", "application/zstd", "application/pdf",
+    "application/vnd.openxmlformats-officedocument."
+)
+
+ORIGINAL_LENGTH_HEADER = "X-Object-Meta-Original-Length"
+
+
+class StreamDecompressor(object):
+
+    def __init__(self, decompress):
+        self._decompress = decompress
+
+    def decompress(self, chunk):
+        data = self._decompress(chunk)
+        if data:
+            yield data
+
+    def flush(self):
+        return b''
+
+
+class GzipCodec(object):
+    encoding = "gzip"
+    default_level = 6
+
+    def __init__(self, level=None):
+        self.level = self.default_level if level is None else level
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, utils.GZIP_WBITS)
+
+    def decompressor(self, chunk_size):
+        return utils.GzipDecompressor(chunk_size)
+
+
+class ZstdCodec(GzipCodec):
+    encoding = "zstd"
+    default_level = 3
+
+    def __init__(self, level=None):
+        if zstandard is None:
+            raise ImportError("The zstd codec requires zstandard")
+        super(ZstdCodec, self).__init__(level)
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompressor(self, chunk_size):
+        return StreamDecompressor(zstandard.ZstdDecompressor().decompressobj().decompress)
+
+
+class BrotliCompressor(object):
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class BrotliCodec(GzipCodec):
+    encoding = "br"
+    default_level = 5
+
+    def __init__(self, level=None):
+        if brotli is None:
+            raise ImportError("The br codec requires brotli")
+        super(BrotliCodec, self).__init__(level)
+
+    def compressor(self):
+        return BrotliCompressor(self.level)
+
+    def decompressor(self, chunk_size):
+        return StreamDecompressor(brotli.Decompressor().process)
+
+
+CODECS = {
+    "gzip": GzipCodec,
+    "x-gzip": GzipCodec,
+    "zstd": ZstdCodec,
+    "br": BrotliCodec,
+    "brotli": BrotliCodec
+}
+
+
+def get_codec(name, level=None):
+    try:
+        return CODECS[name.strip().lower()](level)
+    except KeyError:
+        raise ValueError("Unknown compression codec {}".format(name))
+
+
+def compress_chunks(chunks, codec):
+    compressor = codec.compressor()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decompress_chunks(chunks, encoding, chunk_size=2 ** 20):
+    decompressor = get_codec(encoding).decompressor(chunk_size)
+    for chunk in chunks:
+        for data in decompressor.decompress(chunk):
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def response_encoding(headers, legacy_gzip=False):
+    encoding = headers.get("Content-Encoding")
+    if encoding and encoding.lower() != "identity":
+        return encoding
+    # files uploaded with USE_GZ before they were tagged with Content-Encoding have no original length
+    if legacy_gzip and ORIGINAL_LENGTH_HEADER not in headers:
+        return "gzip"
+    return None
+
+
+def guess_content_type(name, content=None):
+    content_type = getattr(content, "content_type", None)
+    if not content_type:
+        content_type = mimetypes.guess_type(name)[0]
+    return content_type or "application/octet-stream"
+
+
+class Compression(object):
+
+    def __init__(self, codec="gzip", level=None, skip_types=SKIP_TYPES, min_size=0):
+        self.codec = get_codec(codec, level)
+        self.skip_types = tuple(skip_types or ())
+        self.min_size = min_size or 0
+
+    def should_compress(self, content_type, size=None):
+        if size is not None and size < self.min_size:
+            return False
+        content_type = content_type.split(";")[0].strip().lower()
+        return not any(
+            content_type == skip_type or (skip_type.endswith(("/", ".")) and content_type.startswith(skip_type))
+            for skip_type in self.skip_types
+        )
+
+    def compress_chunks(self, chunks):
+        return compress_chunks(chunks, self.codec)
+
+    def headers(self, content_type, size, compressed=True):
+        headers = {"Content-Type": content_type}
+        if size is not None:
+            headers[ORIGINAL_LENGTH_HEADER] = str(size)
+        if compressed:
+            headers["Content-Encoding"] = self.codec.encoding
+        return headers
+
+
+def get_compression(options):
+    return Compression(
+        codec=options.get("CODEC", "gzip"),
+        level=options.get("LEVEL"),
+        skip_types=options.get("SKIP_TYPES", SKIP_TYPES),
+        min_size=options.get("MIN_SIZE", 0)
+    )
@@ -0,0 +1,131 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+clock = getattr(time, "monotonic", time.time)
+
+
+class RequestEvent(object):
+
+    def __init__(self, operation, container=None, path=None):
+        self.operation = operation
+        self.container = container
+        self.path = path
+        self.status = None
+        self.bytes = 0
+        self.retries = 0
+        self.auth_refreshes = 0
+        self.error = None
+        self.started = time.time()
+        self.duration = None
+        self._clock = clock()
+
+    def finish(self, error=None):
+        self.error = error
+        if self.status is None and error is not None:
+            response = getattr(error, "response", None)
+            if response is not None:
+                self.status = response.status_code
+        self.duration = clock() - self._clock
+
+
+class MetricsHook(object):
+
+    def on_start(self, event):
+        pass
+
+    def on_end(self, event):
+        pass
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the requested fraction of observations
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99)
+        }
+
+
+class MetricsAggregator(MetricsHook):
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.errors = defaultdict(int)
+            self.bytes = defaultdict(int)
+            self.retries = defaultdict(int)
+            self.auth_refreshes = 0
+            self.durations = defaultdict(lambda: Histogram(self.buckets))
+
+    def on_end(self, event):
+        with self._lock:
+            self.requests[(event.operation, event.status)] += 1
+            if event.error is not None:
+                self.errors[event.operation] += 1
+            self.bytes[event.operation] += event.bytes
+            self.retries[event.operation] += event.retries
+            self.auth_refreshes += event.auth_refreshes
+            self.durations[event.operation].observe(event.duration)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "errors": dict(self.errors),
+                "bytes": dict(self.bytes),
+                "retries": dict(self.retries),
+                "auth_refreshes": self.auth_refreshes,
+                "durations": {operation: histogram.as_dict() for operation, histogram in self.durations.items()}
+            }
+
+
+aggregator = MetricsAggregator()
+
+
+def get_metrics_hooks(backends):
+    hooks = []
+    for backend in backends or ():
+        if backend == "aggregator":
+            hooks.append(aggregator)
+            continue
+        from django.utils.module_loading import import_string
+        hooks.append(import_string(backend)())
+    return hooks
@@ -0,0 +1,160 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import random
+import threading
+from collections import deque
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from django_selectel.metrics import clock
+
+# statuses after which the request can be sent again without side effects
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# statuses after which the server has not processed the request, a body can be sent again
+UNSAFE_RETRY_STATUSES = (429, 503)
+
+
+# each request deposits `ratio` of a retry and each retry withdraws one, `reserve` allows short bursts
+class RetryBudget(object):
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._balance = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        if self.ratio is None:
+            return
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.reserve)
+
+    def withdraw(self):
+        if self.ratio is None:
+            return True
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold=10, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        # after reset_timeout requests go through again, one more failure opens it at once
+        return self._opened_at is not None and clock() - self._opened_at < self.reset_timeout
+
+    def allow(self):
+        return not self.threshold or not self.is_open
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.threshold and self._failures >= self.threshold:
+                self._opened_at = clock()
+
+
+class LatencyWindow(object):
+
+    def __init__(self, size=1000):
+        self._durations = deque(maxlen=size)
+
+    def observe(self, duration):
+        self._durations.append(duration)
+
+    def percentile(self, fraction, min_samples=20):
+        durations = sorted(self._durations)
+        if len(durations) < min_samples:
+            return None
+        return durations[min(len(durations) - 1, int(fraction * len(durations)))]
+
+
+class RetryPolicy(object):
+
+    def __init__(self, max_attempts=3, backoff=0.1, max_backoff=5, timeout=None, statuses=RETRY_STATUSES,
+                 unsafe_statuses=UNSAFE_RETRY_STATUSES, budget=None, breaker=None, hedge=False, hedge_min_delay=0.01):
+        self.max_attempts = max(1, max_attempts or 1)
+        self.backoff = backoff or 0
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.statuses = statuses
+        self.unsafe_statuses = unsafe_statuses
+        self.budget = budget or RetryBudget(ratio=None)
+        self.breaker = breaker or CircuitBreaker(threshold=None)
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self._latencies = {}
+
+    def is_retryable(self, error, safe=True):
+        response = getattr(error, "response", None)
+        if response is not None:
+            # requests responses have status_code, aiohttp ones status
+            status = getattr(response, "status_code", None) or getattr(response, "status", None)
+            return status in (self.statuses if safe else self.unsafe_statuses)
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            # the connection was not established, nothing was sent
+            return True
+        # ChunkedEncodingError is a connection reset while the body is read
+        if isinstance(error, (
+            requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError
+        )):
+            return safe
+        if aiohttp is not None:
+            if isinstance(error, aiohttp.ClientConnectorError):
+                return True
+            # timeouts of aiohttp are ServerTimeoutError, a ClientConnectionError
+            return safe and isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+        return False
+
+    def start(self):
+        self.budget.deposit()
+        return self.breaker.allow()
+
+    def succeeded(self):
+        self.breaker.record_success()
+
+    def failed(self, error, attempt, safe=True):
+        # attempt counts from 1, returns whether to make another one
+        if not self.is_retryable(error, safe):
+            # the server has answered, it is alive
+            if getattr(error, "response", None) is not None:
+                self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        return attempt < self.max_attempts and self.breaker.allow() and self.budget.withdraw()
+
+    def delay(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def observe(self, operation, duration):
+        window = self._latencies.get(operation)
+        if window is None:
+            window = self._latencies.setdefault(operation, LatencyWindow())
+        window.observe(duration)
+
+    def hedge_delay(self, operation):
+        if not self.hedge or operation not in self._latencies:
+            return None
+        delay = self._latencies[operation].percentile(0.95)
+        return None if delay is None else max(delay, self.hedge_min_delay)
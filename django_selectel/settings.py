@@ -15,11 +15,71 @@ SELECTEL_STORAGE = {
     "PASSWORD": None,
     "DOMAINS": {},
     "OVERWRITE_FILES": False,
+    "NAME_STRATEGY": "exists",
     "USE_GZ": False,
+    "COMPRESSION": {
+        "CODEC": "gzip",
+        "LEVEL": None,
+        "MIN_SIZE": 0
+    },
     "AUTH_URL": "https://auth.selcdn.ru/",
+    "STORAGE_URL": None,
+    "TEMP_URL_KEY": None,
+    "TEMP_URL_EXPIRES": 60 * 60,
     "API_THRESHOLD": 30 * 60,
     "API_MAX_RETRY": 3,
-    "API_RETRY_DELAY": 0.1
+    "API_RETRY_DELAY": 0.1,
+    "API_RETRY_MAX_DELAY": 5,
+    "API_RETRY_BUDGET": 0.2,
+    "API_TIMEOUT": (10, 60),
+    "API_BREAKER_THRESHOLD": None,
+    "API_BREAKER_RESET": 30,
+    "API_HEDGE": False,
+    "API_POOL_CONNECTIONS": 10,
+    "API_POOL_MAXSIZE": 10,
+    "API_POOL_BLOCK": False,
+    "API_TCP_KEEPALIVE": True,
+    "CHUNK_SIZE": 2 ** 20,
+    "PUT_VERIFY": "etag",
+    "SPOOL_MAX_SIZE": 2 ** 22,
+    "RANGE_BLOCK_SIZE": 2 ** 16,
+    "RANGE_CACHE_BLOCKS": 64,
+    "RANGE_READ_AHEAD": 16,
+    "SEGMENT_THRESHOLD": None,
+    "SEGMENT_SIZE": 2 ** 27,
+    "SEGMENT_WORKERS": 4,
+    "SEGMENT_MANIFEST": "static",
+    "SEGMENTS_CONTAINER": None,
+    "DOWNLOAD_WORKERS": 4,
+    "DOWNLOAD_PART_SIZE": 2 ** 23,
+    "BULK_DELETE_SIZE": 1000,
+    "DELETE_WORKERS": 8,
+    "COPY_WORKERS": 8,
+    "ARCHIVE_BATCH_SIZE": 1000,
+    "ARCHIVE_GZIP": False,
+    "PREFETCH_WORKERS": 16,
+    "STATIC_CONTAINER": "static",
+    "STATIC_WORKERS": 8,
+    "STATIC_DELETE_STALE": False,
+    "ASYNC_POOL_SIZE": 100,
+    "ASYNC_CONCURRENCY": 32,
+    "TOKEN_STORE": {
+        "BACKEND": None,
+        "ALIAS": "default",
+        "PATH": None
+    },
+    "DISK_CACHE": {
+        "PATH": None,
+        "MAX_SIZE": 2 ** 30,
+        "FRESHNESS": 0
+    },
+    "METRICS_HOOKS": [],
+    "METADATA_CACHE": {
+        "BACKEND": None,
+        "TTL": 60,
+        "MAX_ENTRIES": 10000,
+        "ALIAS": "default"
+    }
 }
 
 if hasattr(django_settings, "SELECTEL_STORAGE"):
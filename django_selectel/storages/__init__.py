@@ -1,4 +1,4 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
-from .api_storage import ApiStorage
\ No newline at end of file
+from .api_storage import ApiStorage, prefetch_file_metadata
\ No newline at end of file
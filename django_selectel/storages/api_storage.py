@@ -1,22 +1,28 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
-import gzip
+import io
 import os
+import time
+import uuid
 
+import requests
 from django.core.files import File
 from django.core.files.storage import Storage
+from django.utils.crypto import get_random_string
 from django.utils.deconstruct import deconstructible
 from django.utils.functional import cached_property
+from django.utils import timezone
+from django.conf import settings as django_settings
 from django_selectel import settings
-from django_selectel.api import SelectelCDNApi
-from django_selectel import utils
+from django_selectel.api import SelectelCDNApi, SelectelCDNApiException
+from django_selectel import cache, compression, metrics, retry, streams, tokens, utils
 
-
-if utils.is_py3():
-    from io import StringIO, BytesIO
-else:
-    from StringIO import StringIO
+try:
+    from datetime import timezone as datetime_timezone
+    utc = datetime_timezone.utc
+except ImportError:
+    from django.utils.timezone import utc
 
 
 class ApiStorageException(Exception):
@@ -49,20 +55,78 @@ class ApiStorage(Storage):
             auth_url=settings.SELECTEL_STORAGE['AUTH_URL'],
             threshold=settings.SELECTEL_STORAGE['API_THRESHOLD'],
             max_retry=settings.SELECTEL_STORAGE['API_MAX_RETRY'],
-            retry_delay=settings.SELECTEL_STORAGE['API_RETRY_DELAY']
+            retry_delay=settings.SELECTEL_STORAGE['API_RETRY_DELAY'],
+            chunk_size=settings.SELECTEL_STORAGE['CHUNK_SIZE'],
+            put_verify=settings.SELECTEL_STORAGE['PUT_VERIFY'],
+            metadata_cache=cache.get_metadata_cache(settings.SELECTEL_STORAGE['METADATA_CACHE']),
+            bulk_delete_size=settings.SELECTEL_STORAGE['BULK_DELETE_SIZE'],
+            delete_workers=settings.SELECTEL_STORAGE['DELETE_WORKERS'],
+            pool_connections=settings.SELECTEL_STORAGE['API_POOL_CONNECTIONS'],
+            pool_maxsize=settings.SELECTEL_STORAGE['API_POOL_MAXSIZE'],
+            pool_block=settings.SELECTEL_STORAGE['API_POOL_BLOCK'],
+            tcp_keepalive=settings.SELECTEL_STORAGE['API_TCP_KEEPALIVE'],
+            token_store=tokens.get_token_store(settings.SELECTEL_STORAGE['TOKEN_STORE']),
+            storage_url=settings.SELECTEL_STORAGE['STORAGE_URL'],
+            hooks=metrics.get_metrics_hooks(settings.SELECTEL_STORAGE['METRICS_HOOKS']),
+            prefetch_ttl=settings.SELECTEL_STORAGE['METADATA_CACHE'].get('TTL', 60),
+            retry_policy=retry.RetryPolicy(
+                max_attempts=settings.SELECTEL_STORAGE['API_MAX_RETRY'],
+                backoff=settings.SELECTEL_STORAGE['API_RETRY_DELAY'],
+                max_backoff=settings.SELECTEL_STORAGE['API_RETRY_MAX_DELAY'],
+                timeout=settings.SELECTEL_STORAGE['API_TIMEOUT'],
+                budget=retry.RetryBudget(ratio=settings.SELECTEL_STORAGE['API_RETRY_BUDGET']),
+                breaker=retry.CircuitBreaker(
+                    threshold=settings.SELECTEL_STORAGE['API_BREAKER_THRESHOLD'],
+                    reset_timeout=settings.SELECTEL_STORAGE['API_BREAKER_RESET']
+                ),
+                hedge=settings.SELECTEL_STORAGE['API_HEDGE']
+            )
         )
+        self._disk_cache = cache.get_disk_cache(settings.SELECTEL_STORAGE['DISK_CACHE'])
+        self._compression = None
+        if self.use_gz:
+            self._compression = compression.get_compression(settings.SELECTEL_STORAGE['COMPRESSION'])
 
     def get_available_name(self, name, max_length=None):
-        if not self.overwrite_files:
+        if self.overwrite_files:
+            return name
+        strategy = settings.SELECTEL_STORAGE['NAME_STRATEGY']
+        if strategy == "uuid":
+            dir_name, file_name = os.path.split(name)
+            name = os.path.join(dir_name, uuid.uuid4().hex + os.path.splitext(file_name)[1])
+        elif strategy == "listing":
+            name = self._get_available_name_by_listing(name)
+        elif strategy != "conditional":
+            return super(ApiStorage, self).get_available_name(name, max_length)
+        if max_length is not None and len(name) > max_length:
             return super(ApiStorage, self).get_available_name(name, max_length)
         return name
 
+    def _get_available_name_by_listing(self, name):
+        # one listing of the names starting with the file root instead of a HEAD per candidate
+        container, path = self._parse_path(os.path.splitext(name)[0])
+        taken = set(
+            self._join_path(container, entry["name"])
+            for entry in self._api.list_container(container, prefix=path) if "name" in entry
+        )
+        while name in taken:
+            name = self._get_alternative_name(name)
+        return name
+
+    def _get_alternative_name(self, name):
+        dir_name, file_name = os.path.split(name)
+        file_root, file_ext = os.path.splitext(file_name)
+        return os.path.join(dir_name, "{}_{}{}".format(file_root, get_random_string(7), file_ext))
+
     def _parse_path(self, path):
         splited_path = path.split(os.path.sep)
         if len(splited_path) > 1:
             return splited_path[0], os.path.sep.join(splited_path[1:])
         return splited_path[0], ""
 
+    def _join_path(self, container, path):
+        return os.path.sep.join([container, path])
+
     def path(self, name):
         return name
 
@@ -70,44 +134,343 @@ class ApiStorage(Storage):
         container, path = self._parse_path(name)
         return self._api.exist(container, path)
 
+    def listdir(self, path):
+        container, prefix = self._parse_path(path)
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        directories, files = [], []
+        for entry in self._api.list_container(container, prefix=prefix, delimiter='/'):
+            if self._is_segment(entry.get("subdir", entry.get("name"))):
+                continue
+            if "subdir" in entry:
+                directories.append(entry["subdir"][len(prefix):].rstrip('/'))
+            else:
+                files.append(entry["name"][len(prefix):])
+        return directories, files
+
+    def iter_files(self, path):
+        container, prefix = self._parse_path(path)
+        for metadata in self._api.list_container(container, prefix=prefix):
+            if self._is_segment(metadata["name"]):
+                continue
+            yield self._join_path(container, metadata["name"]), metadata
+
+    def _is_segment(self, path):
+        return path.startswith(self._api.segments_prefix + "/")
+
+    def prefetch_metadata(self, names):
+        objects = dict((self._parse_path(name), name) for name in names)
+        results = self._api.head_many(objects.keys(), workers=settings.SELECTEL_STORAGE['PREFETCH_WORKERS'])
+        return dict((objects[item], metadata) for item, metadata in results.items())
+
     def size(self, name):
         container, path = self._parse_path(name)
+        if self.use_gz:
+            # the size of a compressed file before compression, metadata from listings does not have it
+            metadata = self._api.head(container, path)
+            if metadata is not None and "original_size" not in metadata:
+                metadata = self._api.head(container, path, refresh=True)
+            if metadata is not None and metadata.get("original_size") is not None:
+                return metadata["original_size"]
         return self._api.size(container, path)
 
+    def get_modified_time(self, name):
+        container, path = self._parse_path(name)
+        metadata = self._api.head(container, path)
+        if metadata is None:
+            raise SelectelCDNApiException("file {} not exists".format(name))
+        return self._modified_time(metadata["last_modified"])
+
+    def _modified_time(self, value):
+        # the storage returns UTC
+        value = value.replace(tzinfo=utc)
+        if django_settings.USE_TZ:
+            return value
+        return timezone.make_naive(value)
+
     def url(self, name):
         container, path = self._parse_path(name)
         if settings.SELECTEL_STORAGE.get('DOMAINS', {}).get(container):
             return os.path.join(settings.SELECTEL_STORAGE["DOMAINS"][container], path)
         return self._api.get_url(container, path)
 
+    def _temp_url_key(self):
+        key = settings.SELECTEL_STORAGE['TEMP_URL_KEY']
+        if not key:
+            raise ApiStorageException('The "TEMP_URL_KEY" parameter in the SELECTEL_STORAGE settings is not set')
+        return key
+
+    def signed_url(self, name, expires=None, method="GET"):
+        if expires is None:
+            expires = settings.SELECTEL_STORAGE['TEMP_URL_EXPIRES']
+        container, path = self._parse_path(name)
+        return self._api.get_temp_url(container, path, self._temp_url_key(), time.time() + expires, method)
+
+    def upload_form(self, prefix, max_file_size, max_file_count=1, expires=None, redirect=""):
+        if expires is None:
+            expires = settings.SELECTEL_STORAGE['TEMP_URL_EXPIRES']
+        container, path = self._parse_path(prefix)
+        return self._api.get_form_post(
+            container, path, self._temp_url_key(), time.time() + expires,
+            max_file_size=max_file_size, max_file_count=max_file_count, redirect=redirect
+        )
+
     def delete(self, name):
         container, path = self._parse_path(name)
-        self._api.remove(container, path)
+        if self._segments_enabled():
+            self._api.remove_large_object(container, path)
+        else:
+            self._api.remove(container, path)
+        self._drop_cached([name])
+
+    def _drop_cached(self, names):
+        # local copies of the files changed through the storage
+        if self._disk_cache is not None:
+            for name in names:
+                self._disk_cache.delete(name)
+
+    def delete_many(self, names):
+        objects = dict((self._parse_path(name), name) for name in names)
+        self._drop_cached(objects.values())
+        large_objects = []
+        if self._segments_enabled():
+            # large objects are deleted one by one together with their segments
+            metadata = self._api.head_many(
+                objects.keys(), workers=settings.SELECTEL_STORAGE['PREFETCH_WORKERS'], refresh=True
+            )
+            large_objects = [item for item, value in metadata.items() if value is not None and value["large_object"]]
+        results = self._api.delete_many(item for item in objects if item not in large_objects)
+        for container, path in large_objects:
+            try:
+                self._api.remove_large_object(container, path, force=True)
+            except (requests.exceptions.RequestException, SelectelCDNApiException) as e:
+                response = getattr(e, 'response', None)
+                results[(container, path)] = response.status_code if response is not None else 0
+            else:
+                results[(container, path)] = 204
+        return dict((objects[item], status) for item, status in results.items())
+
+    def copy(self, src_name, dst_name):
+        src_container, src_path = self._parse_path(src_name)
+        dst_container, dst_path = self._parse_path(dst_name)
+        self._api.copy(src_container, src_path, dst_container, dst_path)
+        self._drop_cached([dst_name])
+        return dst_name
+
+    def move(self, src_name, dst_name):
+        src_container, src_path = self._parse_path(src_name)
+        dst_container, dst_path = self._parse_path(dst_name)
+        self._api.move(src_container, src_path, dst_container, dst_path, segments=self._segments_enabled())
+        self._drop_cached([src_name, dst_name])
+        return dst_name
+
+    def copy_many(self, names, move=False):
+        names = list(names)
+        pairs = dict(
+            ((self._parse_path(src_name), self._parse_path(dst_name)), dst_name) for src_name, dst_name in names
+        )
+        results = self._api.copy_many(
+            pairs.keys(), move=move, workers=settings.SELECTEL_STORAGE['COPY_WORKERS'],
+            segments=self._segments_enabled()
+        )
+        self._drop_cached(dst_name for src_name, dst_name in names)
+        if move:
+            self._drop_cached(src_name for src_name, dst_name in names)
+        return dict((pairs[pair], status) for pair, status in results.items())
 
     def _save(self, name, content):
+        headers = None
+        if not self.overwrite_files and settings.SELECTEL_STORAGE['NAME_STRATEGY'] == "conditional":
+            headers = {"If-None-Match": "*"}
+        while True:
+            try:
+                self._put(name, content, headers)
+            except SelectelCDNApiException as e:
+                # the name was taken after all, the PUT did not overwrite the file
+                if headers and e.response is not None and e.response.status_code == 412:
+                    name = self._get_alternative_name(name)
+                    continue
+                raise
+            break
+        self._drop_cached([name])
+        return name
+
+    def save_many(self, files):
+        # one request per batch of files, the names are used as is and existing files are overwritten
+        if isinstance(files, dict):
+            files = files.items()
+        containers = {}
+        for name, content in files:
+            container, path = self._parse_path(name)
+            containers.setdefault(container, []).append((path, name, content))
+
+        results = {}
+        batch_size = settings.SELECTEL_STORAGE['ARCHIVE_BATCH_SIZE']
+        for container, items in containers.items():
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                names = dict((path, name) for path, name, content in batch)
+                statuses = self._api.extract_archive(
+                    container,
+                    [(path, self._archive_content(content)) for path, name, content in batch],
+                    compress=settings.SELECTEL_STORAGE['ARCHIVE_GZIP']
+                )
+                results.update((names[path], status) for path, status in statuses.items())
+        self._drop_cached(results)
+        return results
+
+    def _archive_content(self, content):
+        if not self.use_gz:
+            return content
+        if hasattr(content, 'read'):
+            utils.rewind(content)
+            chunks = utils.iter_chunks(content, self._api.chunk_size)
+        else:
+            chunks = [utils.to_bytes(content)]
+        # extract-archive cannot set Content-Encoding, such files are read as Gzip without it
+        return b''.join(compression.compress_chunks(chunks, compression.GzipCodec()))
+
+    def _compression_headers(self, name, content):
+        # returns whether to compress the file and the headers of the upload
+        try:
+            size = len(content) if isinstance(content, bytes) else content.size
+        except (AttributeError, TypeError):
+            size = None
+        content_type = compression.guess_content_type(name, content)
+        # without the original length a file is recognized only by Content-Encoding
+        compressed = size is None or self._compression.should_compress(content_type, size)
+        return compressed, self._compression.headers(content_type, size, compressed)
+
+    def _put(self, name, content, headers=None):
         container, path = self._parse_path(name)
+        previous_segments = self._previous_segments(container, path)
+        self._put_content(container, path, name, content, headers)
+        if previous_segments:
+            # the new file has replaced the manifest that referred to them
+            self._api.delete_many(previous_segments)
+
+    def _previous_segments(self, container, path):
+        if not self._segments_enabled():
+            return []
+        metadata = self._api.head(container, path, refresh=True)
+        if metadata is None or not metadata["large_object"]:
+            return []
+        return self._api.large_object_segments(container, path, metadata)
+
+    def _put_content(self, container, path, name, content, headers=None):
         if hasattr(content.file, 'seek'):
             content.file.seek(0)
 
         if self.use_gz:
-            g_file = StringIO()
-            g_file_gzip = gzip.GzipFile(fileobj=g_file, mode="wb")
-            g_file_gzip.write(content.read())
-            g_file_gzip.close()
-            file_content = g_file.getvalue()
+            compressed, compression_headers = self._compression_headers(name, content)
+            headers = dict(headers or {}, **compression_headers)
+            if compressed:
+                def compressed_chunks():
+                    utils.rewind(content)
+                    return self._compression.compress_chunks(utils.iter_chunks(content, self._api.chunk_size))
+                self._api.put(container, path, streams.IterStream(compressed_chunks), headers=headers)
+                return
+
+        if self._is_segmented(content):
+            self._api.put_segmented(
+                container, path, content,
+                size=content.size,
+                segment_size=settings.SELECTEL_STORAGE['SEGMENT_SIZE'],
+                workers=settings.SELECTEL_STORAGE['SEGMENT_WORKERS'],
+                manifest=settings.SELECTEL_STORAGE['SEGMENT_MANIFEST'],
+                segments_container=settings.SELECTEL_STORAGE['SEGMENTS_CONTAINER'],
+                headers=headers
+            )
         else:
-            file_content = content.read()
-        self._api.put(container, path, file_content)
-        return name
+            self._api.put(container, path, content, headers=headers)
+
+    def _segments_enabled(self):
+        # files may be large objects, deletions and overwrites also remove their segments
+        return settings.SELECTEL_STORAGE['SEGMENT_THRESHOLD'] is not None
+
+    def _is_segmented(self, content):
+        threshold = settings.SELECTEL_STORAGE['SEGMENT_THRESHOLD']
+        if threshold is None:
+            return False
+        try:
+            return content.size > threshold
+        except (AttributeError, TypeError):
+            return False
+
+    def download(self, name, local_path):
+        if self.use_gz:
+            with self.open(name) as src, open(local_path, 'wb') as dst:
+                for chunk in src.chunks(self._api.chunk_size):
+                    dst.write(chunk)
+            return
+        container, path = self._parse_path(name)
+        with open(local_path, 'w+b') as dst:
+            self._api.download(
+                container, path, dst,
+                workers=settings.SELECTEL_STORAGE['DOWNLOAD_WORKERS'],
+                part_size=settings.SELECTEL_STORAGE['DOWNLOAD_PART_SIZE']
+            )
 
     def _open(self, name, mode='rb'):
         return SelectelCDNFile(self, name)
 
     def _read(self, name):
+        if self._disk_cache is not None:
+            with self._open_cached(name) as fh:
+                return fh.read()
+        if self.use_gz:
+            return b''.join(self._read_decoded(name))
         container, path = self._parse_path(name)
         content = self._api.get(container, path)
         return content
 
+    def _read_decoded(self, name):
+        container, path = self._parse_path(name)
+        return self._decode_response(self._api.get_response(container, path))
+
+    def _decode_response(self, response):
+        # the encoding is taken from the headers of each file, not from the settings
+        chunk_size = self._api.chunk_size
+        encoding = compression.response_encoding(response.headers, legacy_gzip=self.use_gz)
+        if encoding is None:
+            return response.iter_content(chunk_size=chunk_size)
+        chunks = response.raw.stream(chunk_size, decode_content=False)
+        return compression.decompress_chunks(chunks, encoding, chunk_size)
+
+    def _open_cached(self, name):
+        container, path = self._parse_path(name)
+
+        def fetch(etag):
+            headers = {"If-None-Match": etag} if etag else None
+            r = self._api.get_response(container, path, headers=headers)
+            if r.status_code == 304:
+                r.close()
+                return None
+            return r.headers.get('ETag', '').strip('"'), self._decode_response(r)
+
+        return self._disk_cache.open(name, fetch)
+
+    def _read_range(self, name, start, end=None):
+        container, path = self._parse_path(name)
+        return self._api.get_range(container, path, start, end)
+
+    def _read_stream(self, name):
+        container, path = self._parse_path(name)
+        return self._api.get_steam(container, path, chunk=self._api.chunk_size)
+
+
+def prefetch_file_metadata(instances, *field_names):
+    instances = list(instances)
+    names = {}
+    for instance in instances:
+        for field_name in field_names:
+            field_file = getattr(instance, field_name)
+            if field_file and isinstance(field_file.storage, ApiStorage):
+                names.setdefault(field_file.storage, set()).add(field_file.name)
+    for storage, storage_names in names.items():
+        storage.prefetch_metadata(storage_names)
+    return instances
+
 
 class SelectelCDNFile(File):
 
@@ -118,10 +481,12 @@ class SelectelCDNFile(File):
         self._file = None
         self._is_dirty = False
 
-    @cached_property
+    @property
     def content(self):
-        content = self.read()
+        position = self.tell()
         self.seek(0)
+        content = self.read()
+        self.seek(position)
         return content
 
     def open(self, mode=None):
@@ -138,19 +503,50 @@ class SelectelCDNFile(File):
     @property
     def file(self):
         if not self._file:
-            content = self._storage._read(self._path)
+            if self._storage._disk_cache is not None:
+                # the cache keeps decoded files
+                self._file = self._storage._open_cached(self._path)
+                return self._file
             if self._storage.use_gz:
-                content_obj = StringIO(content)
-                content_obj.seek(0)
-                content = gzip.GzipFile(fileobj=content_obj, mode='rb').read()
-            if utils.is_py3() and isinstance(content, bytes):
-                self._file = BytesIO(content)
-            else:
-                self._file = StringIO(content)
-            
-            self._file.seek(0)
+                # decompressed lazily while the caller reads
+                self._file = self._spool(self._storage._read_decoded(self._path))
+                return self._file
+            block_size = settings.SELECTEL_STORAGE['RANGE_BLOCK_SIZE']
+            range_file = streams.RangeFile(
+                fetch=lambda start, end: self._storage._read_range(self._path, start, end),
+                get_size=lambda: self.size,
+                block_size=block_size,
+                cache_blocks=settings.SELECTEL_STORAGE['RANGE_CACHE_BLOCKS'],
+                read_ahead=settings.SELECTEL_STORAGE['RANGE_READ_AHEAD']
+            )
+            self._file = io.BufferedReader(range_file, buffer_size=block_size)
         return self._file
 
+    def _spool(self, chunks):
+        return streams.SpooledStream(chunks, max_size=settings.SELECTEL_STORAGE['SPOOL_MAX_SIZE'])
+
+    def _replace_with_spool(self, chunks):
+        position = self.file.tell()
+        self.file.close()
+        self._file = self._spool(chunks)
+        self._file.seek(position)
+        return self._file
+
+    def _writable_file(self):
+        if not self.file.writable():
+            # the old file object stays open until the spool has consumed it
+            source = self.file
+            position = source.tell()
+            source.seek(0)
+            self._file = self._spool(utils.iter_chunks(source, self._storage._api.chunk_size))
+            self._file.seek(position)
+        return self._file
+
+    def getbuffer(self):
+        if not hasattr(self.file, 'getbuffer'):
+            self._replace_with_spool(self._storage._read_stream(self._path))
+        return self.file.getbuffer()
+
     def readlines(self):
         return self.file.readlines()
 
@@ -161,7 +557,7 @@ class SelectelCDNFile(File):
             return self.file.read()
 
     def write(self, content):
-        self.file.write(content)
+        self._writable_file().write(content)
         self._is_dirty = True
 
     def close(self):
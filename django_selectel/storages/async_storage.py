@@ -0,0 +1,127 @@
+# coding=utf-8
+import os
+
+from django.utils.crypto import get_random_string
+
+from django_selectel import compression, settings, utils
+from django_selectel.aio import AsyncSelectelCDNApi
+from django_selectel.storages.api_storage import ApiStorage
+
+
+class AsyncApiStorage(object):
+
+    def __init__(self, storage=None, **kwargs):
+        self.storage = storage or ApiStorage(**kwargs)
+        self._api = AsyncSelectelCDNApi(
+            user=self.storage.user,
+            password=self.storage.password,
+            auth_url=settings.SELECTEL_STORAGE['AUTH_URL'],
+            threshold=settings.SELECTEL_STORAGE['API_THRESHOLD'],
+            max_retry=settings.SELECTEL_STORAGE['API_MAX_RETRY'],
+            retry_delay=settings.SELECTEL_STORAGE['API_RETRY_DELAY'],
+            chunk_size=settings.SELECTEL_STORAGE['CHUNK_SIZE'],
+            metadata_cache=self.storage._api.metadata_cache,
+            put_verify=settings.SELECTEL_STORAGE['PUT_VERIFY'],
+            pool_size=settings.SELECTEL_STORAGE['ASYNC_POOL_SIZE'],
+            concurrency=settings.SELECTEL_STORAGE['ASYNC_CONCURRENCY'],
+            retry_policy=self.storage._api.retry_policy
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._api.close()
+
+    def url(self, name):
+        return self.storage.url(name)
+
+    async def exists(self, name):
+        container, path = self.storage._parse_path(name)
+        return await self._api.exist(container, path)
+
+    async def size(self, name):
+        container, path = self.storage._parse_path(name)
+        if self.storage.use_gz:
+            # the size of a compressed file before compression, metadata from listings does not have it
+            metadata = await self._api.head(container, path)
+            if metadata is not None and "original_size" not in metadata:
+                metadata = await self._api.head(container, path, refresh=True)
+            if metadata is not None and metadata.get("original_size") is not None:
+                return metadata["original_size"]
+        return await self._api.size(container, path)
+
+    async def delete(self, name):
+        container, path = self.storage._parse_path(name)
+        await self._api.remove(container, path)
+
+    async def stream(self, name):
+        container, path = self.storage._parse_path(name)
+        headers, chunks = await self._api.get_response_stream(container, path, chunk=self._api.chunk_size)
+        encoding = compression.response_encoding(headers, legacy_gzip=self.storage.use_gz)
+        if encoding is None:
+            async for chunk in chunks:
+                yield chunk
+            return
+        decompressor = compression.get_codec(encoding).decompressor(self._api.chunk_size)
+        async for chunk in chunks:
+            for data in decompressor.decompress(chunk):
+                yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    async def read(self, name):
+        return b''.join([chunk async for chunk in self.stream(name)])
+
+    async def get_available_name(self, name):
+        if self.storage.overwrite_files:
+            return name
+        dir_name, file_name = os.path.split(name)
+        file_root, file_ext = os.path.splitext(file_name)
+        while await self.exists(name):
+            name = os.path.join(dir_name, "{}_{}{}".format(file_root, get_random_string(7), file_ext))
+        return name
+
+    async def save(self, name, content):
+        name = await self.get_available_name(name)
+        container, path = self.storage._parse_path(name)
+        headers = None
+        if self.storage.use_gz:
+            if isinstance(content, str):
+                content = utils.to_bytes(content)
+            compressed, headers = self.storage._compression_headers(name, content)
+            if compressed:
+                content = self._compressed_body(content)
+        await self._api.put(container, path, content, headers=headers)
+        return name
+
+    def _compressed_body(self, content):
+        # an async iterator can be read once, other content is compressed anew for each attempt of the upload
+        if hasattr(content, '__aiter__'):
+            return self._compress(content)
+        return lambda: self._compress(content)
+
+    async def _compress(self, content):
+        compressor = self.storage._compression.codec.compressor()
+        if hasattr(content, 'read'):
+            utils.rewind(content)
+            content = utils.iter_chunks(content, self._api.chunk_size)
+        elif not hasattr(content, '__aiter__'):
+            content = [utils.to_bytes(content)]
+        if hasattr(content, '__aiter__'):
+            async for chunk in content:
+                yield compressor.compress(utils.to_bytes(chunk))
+        else:
+            for chunk in content:
+                yield compressor.compress(chunk)
+        yield compressor.flush()
+
+    async def exists_many(self, names):
+        return dict(zip(names, await self._api.gather([self.exists(name) for name in names])))
+
+    async def delete_many(self, names):
+        return dict(zip(names, await self._api.gather([self.delete(name) for name in names])))
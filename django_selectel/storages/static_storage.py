@@ -0,0 +1,185 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import atexit
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from django.contrib.staticfiles.storage import ManifestFilesMixin
+from django.utils.deconstruct import deconstructible
+
+from django_selectel import settings, utils
+from django_selectel.api import SelectelCDNApiException
+from django_selectel.storages.api_storage import ApiStorage, ApiStorageException
+
+
+@deconstructible
+class StaticApiStorage(ApiStorage):
+
+    def __init__(self, container=None, **kwargs):
+        kwargs.setdefault("overwrite_files", True)
+        super(StaticApiStorage, self).__init__(**kwargs)
+        self.container = container or settings.SELECTEL_STORAGE['STATIC_CONTAINER']
+        self._remote = None
+        self._collected = set()
+        self._deleted = set()
+        self._pending = {}
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(settings.SELECTEL_STORAGE['STATIC_WORKERS'] * 4)
+        self._lock = threading.RLock()
+        self._flush_registered = False
+
+    def _parse_path(self, path):
+        return self.container, path
+
+    def _join_path(self, container, path):
+        return path
+
+    def _remote_files(self):
+        # one listing of the container instead of a HEAD per file
+        with self._lock:
+            if self._remote is None:
+                self._remote = dict(
+                    (metadata["name"], metadata) for metadata in self._api.list_container(self.container)
+                )
+            return self._remote
+
+    def exists(self, name):
+        with self._lock:
+            if name in self._deleted:
+                return False
+            return name in self._remote_files()
+
+    def get_modified_time(self, name):
+        with self._lock:
+            metadata = None if name in self._deleted else self._remote_files().get(name)
+        if metadata is None:
+            raise SelectelCDNApiException("file {} not exists".format(name))
+        return self._modified_time(metadata["last_modified"])
+
+    def delete(self, name):
+        # collectstatic deletes a changed file before saving it again,
+        # deletions wait for flush() and are cancelled by saving the file
+        with self._lock:
+            self._deleted.add(name)
+            self._register_flush()
+
+    def _save(self, name, content):
+        utils.rewind(content)
+        chunks = utils.iter_chunks(content, self._api.chunk_size)
+        headers = None
+        if self.use_gz:
+            compressed, headers = self._compression_headers(name, content)
+            if compressed:
+                chunks = self._compression.compress_chunks(chunks)
+        md5 = hashlib.md5()
+        size = getattr(content, "size", None)
+        payload = None
+        if size is not None and size <= settings.SELECTEL_STORAGE['SPOOL_MAX_SIZE']:
+            payload = b''.join(utils.iter_hashed(chunks, md5))
+        else:
+            for chunk in utils.iter_hashed(chunks, md5):
+                pass
+
+        with self._lock:
+            self._deleted.discard(name)
+            self._collected.add(name)
+            metadata = self._remote_files().get(name)
+            if metadata is not None and metadata["etag"] == md5.hexdigest():
+                return name
+            self._remote[name] = {
+                "name": name,
+                "size": size,
+                "etag": md5.hexdigest(),
+                "content_type": None,
+                "last_modified": datetime.utcnow(),
+                "large_object": False
+            }
+        if payload is None:
+            self._wait(name)
+            return super(StaticApiStorage, self)._save(name, content)
+        self._submit(name, payload, headers)
+        return name
+
+    def _submit(self, name, payload, headers=None):
+        # the number of files read to memory and waiting for upload is limited
+        self._slots.acquire()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=settings.SELECTEL_STORAGE['STATIC_WORKERS'])
+            self._register_flush()
+            future = self._executor.submit(self._upload, name, payload, headers, self._pending.get(name))
+            self._pending[name] = future
+        future.add_done_callback(lambda future: self._slots.release())
+
+    def _upload(self, name, payload, headers, previous):
+        # a file saved again is uploaded after the previous version
+        if previous is not None:
+            wait([previous])
+        container, path = self._parse_path(name)
+        self._api.put(container, path, payload, headers=headers)
+        if self._disk_cache is not None:
+            self._disk_cache.delete(name)
+
+    def _wait(self, name):
+        with self._lock:
+            future = self._pending.get(name)
+        if future is not None:
+            future.result()
+
+    def _open(self, name, mode='rb'):
+        self._wait(name)
+        return super(StaticApiStorage, self)._open(name, mode)
+
+    def _register_flush(self):
+        if not self._flush_registered:
+            self._flush_registered = True
+            atexit.register(self.flush)
+
+    def flush(self, keep=None):
+        # waits for the uploads and deletes the files deleted since the last flush, with STATIC_DELETE_STALE
+        # also the files of the container that were neither saved nor listed in keep
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+            deleted, self._deleted = self._deleted, set()
+            collected, self._collected = self._collected, set()
+            remote, self._remote = self._remote, None
+        for future in pending:
+            future.result()
+
+        if keep is not None and settings.SELECTEL_STORAGE['STATIC_DELETE_STALE'] and remote is not None:
+            stale = set(name for name in remote if not name.startswith(self._api.segments_prefix + "/"))
+            deleted |= stale - collected - set(keep)
+        if not deleted:
+            return
+        failed = dict(
+            (name, status) for name, status in self.delete_many(deleted).items() if status not in (204, 404)
+        )
+        if failed:
+            raise ApiStorageException("Error delete files: {}".format(failed))
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            self.flush(keep=paths)
+        return []
+
+
+@deconstructible
+class ManifestStaticApiStorage(ManifestFilesMixin, StaticApiStorage):
+
+    def read_manifest(self):
+        try:
+            content = self._read(self.manifest_name)
+        except SelectelCDNApiException as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        return content.decode('utf-8')
+
+    def post_process(self, paths, dry_run=False, **options):
+        for result in super(ManifestStaticApiStorage, self).post_process(paths, dry_run=dry_run, **options):
+            yield result
+        if not dry_run:
+            self.flush(keep=set(paths) | set(self.hashed_files.values()) | {self.manifest_name})
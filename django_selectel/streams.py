@@ -0,0 +1,366 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import io
+import mmap
+import tempfile
+from collections import OrderedDict
+
+
+class IterStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of byte chunks.
+
+    `factory` returns a fresh iterator; it is called again when the stream
+    is rewound, so the data is produced lazily and never held as a whole.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._iter = None
+        self._chunk = b''
+        self._offset = 0
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("can't seek relative to the end of a stream")
+        if offset < self._pos:
+            self._iter = None
+            self._chunk = b''
+            self._offset = 0
+            self._pos = 0
+        buf = bytearray(min(offset - self._pos, 2 ** 16))
+        while self._pos < offset:
+            view = memoryview(buf)[:offset - self._pos]
+            if not self.readinto(view):
+                break
+        return self._pos
+
+    def readinto(self, b):
+        if self._iter is None:
+            self._iter = iter(self._factory())
+        while self._offset >= len(self._chunk):
+            try:
+                self._chunk = next(self._iter)
+            except StopIteration:
+                self._chunk = b''
+                self._offset = 0
+                return 0
+            self._offset = 0
+        size = min(len(b), len(self._chunk) - self._offset)
+        b[:size] = self._chunk[self._offset:self._offset + size]
+        self._offset += size
+        self._pos += size
+        return size
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Seekable read-only file object backed by HTTP range requests.
+
+    `fetch(start, end)` returns `(content, first_byte, total_size)`, `end` is
+    None for the rest of the file. Fetched data is kept in an LRU cache of
+    `block_size` blocks, and sequential reads pull `read_ahead` extra blocks
+    with the same request. `readall()` and reads larger than a read-ahead
+    request are served with a single request and not cached.
+    """
+
+    def __init__(self, fetch, get_size, block_size=2 ** 16, cache_blocks=64, read_ahead=16):
+        self._fetch = fetch
+        self._get_size = get_size
+        self._size = None
+        self._pos = 0
+        self._block_size = block_size
+        self._cache_blocks = max(cache_blocks, read_ahead + 1)
+        self._read_ahead = read_ahead
+        self._blocks = OrderedDict()
+        self._last_block = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self._get_size()
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self._pos = offset
+        return self._pos
+
+    def readall(self):
+        if self._size is not None and self._pos >= self._size:
+            return b''
+        return self._read_direct(self._pos, None)
+
+    def readinto(self, b):
+        written = 0
+        while written < len(b):
+            if self._size is not None and self._pos >= self._size:
+                break
+            index, offset = divmod(self._pos, self._block_size)
+            if index not in self._blocks and len(b) - written > self._block_size * (self._read_ahead + 1):
+                data = self._read_direct(self._pos, self._pos + len(b) - written - 1)
+                b[written:written + len(data)] = data
+                written += len(data)
+                break
+            block = self._get_block(index)
+            data = block[offset:offset + len(b) - written]
+            if not data:
+                break
+            b[written:written + len(data)] = data
+            written += len(data)
+            self._pos += len(data)
+        return written
+
+    def _read_direct(self, start, end):
+        content, first, total = self._fetch(start, end)
+        self._size = total
+        # a server ignoring the Range header returns the whole object from the first byte
+        data = content[start - first:] if end is None else content[start - first:end - first + 1]
+        self._pos += len(data)
+        return data
+
+    def _get_block(self, index):
+        block = self._blocks.pop(index, None)
+        if block is None:
+            count = 1
+            if self._last_block is not None and index == self._last_block + 1:
+                count += self._read_ahead
+            block = self._load_blocks(index, count)
+        self._blocks[index] = block
+        self._last_block = index
+        return block
+
+    def _load_blocks(self, index, count):
+        start = index * self._block_size
+        end = start + count * self._block_size - 1
+        if self._size is not None:
+            end = min(end, self._size - 1)
+        content, first, total = self._fetch(start, end)
+        self._size = total
+        # a server ignoring the Range header returns the whole object from the first byte
+        first_index = first // self._block_size
+        for i in range(0, len(content), self._block_size):
+            self._blocks[first_index + i // self._block_size] = content[i:i + self._block_size]
+        block = self._blocks.pop(index, b'')
+        while len(self._blocks) >= self._cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+
+class FileSegment(io.RawIOBase):
+    """
+    Read-only window of `length` bytes starting at `offset` of a file object
+    shared between threads, which serialize access with `lock`.
+    """
+
+    def __init__(self, fileobj, offset, length, lock):
+        self._fileobj = fileobj
+        self._offset = offset
+        self._length = length
+        self._lock = lock
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        return self._pos
+
+    def readinto(self, b):
+        size = min(len(b), self._length - self._pos)
+        if size <= 0:
+            return 0
+        with self._lock:
+            self._fileobj.seek(self._offset + self._pos)
+            data = self._fileobj.read(size)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class MmapFile(io.RawIOBase):
+    """
+    Read-only file object over a memory-mapped file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._mmap.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._mmap.seek(offset, whence)
+        return self._mmap.tell()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._mmap) - self._mmap.tell()
+        return self._mmap.read(size)
+
+    readall = read
+
+    def readline(self, size=-1):
+        line = self._mmap.readline()
+        if size is not None and 0 <= size < len(line):
+            self._mmap.seek(size - len(line), io.SEEK_CUR)
+            line = line[:size]
+        return line
+
+    def readinto(self, b):
+        data = self._mmap.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def getbuffer(self):
+        return memoryview(self._mmap)
+
+    def close(self):
+        if not self.closed:
+            self._mmap.close()
+        super(MmapFile, self).close()
+
+
+class SpooledStream(io.RawIOBase):
+    """
+    Seekable, writable file object over an iterator of byte chunks.
+
+    Chunks are copied into a SpooledTemporaryFile only as far as the caller
+    reads, so the first bytes are available before the whole stream is
+    consumed, and data above `max_size` bytes is kept on disk.
+    """
+
+    def __init__(self, chunks, max_size=2 ** 22):
+        self._chunks = iter(chunks)
+        self._spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self._filled = 0
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def _fill(self, size=None):
+        while self._chunks is not None and (size is None or self._filled < size):
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._chunks = None
+                break
+            self._spool.seek(self._filled)
+            self._spool.write(chunk)
+            self._filled += len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            self._fill()
+            offset += self._filled
+        if offset < 0:
+            raise ValueError("negative seek position {}".format(offset))
+        self._pos = offset
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            self._fill()
+        else:
+            self._fill(self._pos + size)
+        self._spool.seek(self._pos)
+        data = self._spool.read(self._filled - self._pos if size is None or size < 0 else size)
+        self._pos += len(data)
+        return data
+
+    readall = read
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        while True:
+            self._spool.seek(self._pos)
+            line = self._spool.readline(self._filled - self._pos)
+            if line.endswith(b'\n') or self._chunks is None or 0 <= (size or -1) <= len(line):
+                break
+            self._fill(self._filled + 1)
+        if size is not None and 0 <= size < len(line):
+            line = line[:size]
+        self._pos += len(line)
+        return line
+
+    def write(self, b):
+        self._fill()
+        self._spool.seek(self._pos)
+        self._spool.write(b)
+        self._pos += len(b)
+        self._filled = max(self._filled, self._pos)
+        return len(b)
+
+    def getbuffer(self):
+        self._fill()
+        if not self._filled:
+            return memoryview(b'')
+        self._spool.flush()
+        # fileno() moves the spooled data to disk, the file is then mapped without a copy
+        return memoryview(mmap.mmap(self._spool.fileno(), self._filled, access=mmap.ACCESS_READ))
+
+    def close(self):
+        if not self.closed:
+            self._spool.close()
+        super(SpooledStream, self).close()
@@ -0,0 +1,338 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import random
+import threading
+import time
+from email.utils import formatdate
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+
+class SwiftObject(object):
+
+    def __init__(self, data, content_type, headers=None):
+        self.data = data
+        self.etag = hashlib.md5(data).hexdigest()
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.last_modified = time.time()
+
+
+class SwiftStandInServer(ThreadingMixIn, HTTPServer):
+    """
+    In-memory stand-in for the Selectel auth endpoint and the Swift object API.
+
+    Supports auth, PUT/GET/HEAD/DELETE, Range, conditional requests, COPY and
+    X-Copy-From, JSON listings, bulk delete, extract-archive and large object
+    manifests. `latency` (seconds) delays every request and `error_rate` fails
+    that share of requests with a 503, to exercise retries.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0, error_rate=0, token_ttl=3600):
+        HTTPServer.__init__(self, address, SwiftRequestHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.token = "stand-in-token"
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.requests = []
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    @property
+    def auth_url(self):
+        return self.url + "/auth/"
+
+    @property
+    def storage_url(self):
+        return self.url + "/v1/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class SwiftRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        headers = dict(headers or {})
+        if "Content-Length" not in headers:
+            headers["Content-Length"] = str(len(body))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD" and body:
+            self.wfile.write(body)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    break
+                chunks.append(chunk)
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _handle(self):
+        server = self.server
+        parsed = urlparse(self.path)
+        query = dict((key, values[0]) for key, values in parse_qs(parsed.query, keep_blank_values=True).items())
+        server.requests.append((self.command, parsed.path))
+        body = self._read_body() if self.command in ("PUT", "POST") else b''
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            return self._send(503)
+
+        if parsed.path == "/auth/":
+            return self._send(204, headers={
+                "X-Auth-Token": server.token,
+                "X-Storage-Url": server.storage_url,
+                "X-Expire-Auth-Token": str(server.token_ttl)
+            })
+        if self.headers.get("X-Auth-Token") != server.token and "temp_url_sig" not in query:
+            return self._send(401)
+        if not parsed.path.startswith("/v1/"):
+            return self._send(404)
+
+        path = unquote(parsed.path[len("/v1/"):])
+        if not path:
+            if "bulk-delete" in query:
+                return self._bulk_delete(body)
+            return self._send(404)
+        container, _, name = path.partition("/")
+        if "extract-archive" in query:
+            return self._extract_archive(container, name, body, query["extract-archive"])
+        if not name:
+            return self._listing(container, query)
+        return getattr(self, "_object_" + self.command.lower())(container, name, body, query)
+
+    do_GET = do_PUT = do_HEAD = do_DELETE = do_POST = do_COPY = _handle
+
+    def _headers(self, obj):
+        headers = {
+            "ETag": obj.etag,
+            "Content-Type": obj.content_type,
+            "Last-Modified": formatdate(obj.last_modified, usegmt=True),
+            "Accept-Ranges": "bytes"
+        }
+        headers.update(obj.headers)
+        return headers
+
+    def _resolve(self, obj):
+        manifest = obj.headers.get("X-Object-Manifest")
+        if manifest:
+            prefix = manifest
+            keys = sorted(key for key in self.server.objects if key.startswith(prefix))
+            return b''.join(self.server.objects[key].data for key in keys)
+        if obj.headers.get("X-Static-Large-Object"):
+            segments = json.loads(obj.data.decode('utf-8'))
+            return b''.join(self.server.objects[segment["path"].lstrip("/")].data for segment in segments)
+        return obj.data
+
+    def _object_get(self, container, name, body, query):
+        obj = self.server.objects.get(container + "/" + name)
+        if obj is None:
+            return self._send(404)
+        if query.get("multipart-manifest") == "get" and obj.headers.get("X-Static-Large-Object"):
+            manifest = [
+                {"name": segment["path"], "hash": segment["etag"], "bytes": segment["size_bytes"]}
+                for segment in json.loads(obj.data.decode('utf-8'))
+            ]
+            return self._send(200, json.dumps(manifest).encode('utf-8'), {"Content-Type": "application/json"})
+        headers = self._headers(obj)
+        if self.headers.get("If-None-Match") in (obj.etag, '"{}"'.format(obj.etag)):
+            return self._send(304, headers={"ETag": obj.etag})
+        data = self._resolve(obj)
+        headers["Content-Length"] = str(len(data))
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].partition("-")
+            if not first:
+                first, last = max(0, len(data) - int(last)), len(data) - 1
+            first, last = int(first), min(int(last) if last else len(data) - 1, len(data) - 1)
+            if first >= len(data):
+                return self._send(416, headers={"Content-Range": "bytes */{}".format(len(data))})
+            headers["Content-Range"] = "bytes {}-{}/{}".format(first, last, len(data))
+            data = data[first:last + 1]
+            headers["Content-Length"] = str(len(data))
+            return self._send(206, data, headers)
+        return self._send(200, data, headers)
+
+    _object_head = _object_get
+
+    def _object_put(self, container, name, body, query):
+        key = container + "/" + name
+        if self.headers.get("If-None-Match") == "*" and key in self.server.objects:
+            return self._send(412)
+        copy_from = self.headers.get("X-Copy-From")
+        if copy_from:
+            source = self.server.objects.get(unquote(copy_from).lstrip("/"))
+            if source is None:
+                return self._send(404)
+            obj = SwiftObject(self._resolve(source), source.content_type)
+        else:
+            if self.headers.get("ETag") and self.headers["ETag"] != hashlib.md5(body).hexdigest():
+                return self._send(422)
+            headers = dict(
+                (key_, value) for key_, value in self.headers.items()
+                if key_.lower().startswith("x-object-meta-") or key_.lower() in ("content-encoding", "x-object-manifest")
+            )
+            if query.get("multipart-manifest") == "put":
+                headers["X-Static-Large-Object"] = "True"
+            obj = SwiftObject(body, self.headers.get("Content-Type", "application/octet-stream"), headers)
+        with self.server.lock:
+            self.server.objects[key] = obj
+        return self._send(201, headers={"ETag": obj.etag})
+
+    def _object_copy(self, container, name, body, query):
+        source = self.server.objects.get(container + "/" + name)
+        if source is None:
+            return self._send(404)
+        destination = unquote(self.headers["Destination"]).lstrip("/")
+        self.server.objects[destination] = SwiftObject(self._resolve(source), source.content_type)
+        return self._send(201)
+
+    def _object_post(self, container, name, body, query):
+        obj = self.server.objects.get(container + "/" + name)
+        if obj is None:
+            return self._send(404)
+        obj.headers.update(
+            (key, value) for key, value in self.headers.items() if key.lower().startswith("x-object-meta-")
+        )
+        return self._send(202)
+
+    def _object_delete(self, container, name, body, query):
+        with self.server.lock:
+            obj = self.server.objects.pop(container + "/" + name, None)
+            if obj is None:
+                return self._send(404)
+            if query.get("multipart-manifest") != "delete" or not obj.headers.get("X-Static-Large-Object"):
+                return self._send(204)
+            segments = json.loads(obj.data.decode('utf-8'))
+            for segment in segments:
+                self.server.objects.pop(segment["path"].lstrip("/"), None)
+        report = {
+            "Number Deleted": len(segments) + 1,
+            "Number Not Found": 0,
+            "Response Status": "200 OK",
+            "Response Body": "",
+            "Errors": []
+        }
+        return self._send(200, json.dumps(report).encode('utf-8'), {"Content-Type": "application/json"})
+
+    def _listing(self, container, query):
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter")
+        marker = query.get("marker", "")
+        limit = int(query.get("limit", 10000))
+        entries = []
+        subdirs = set()
+        for key in sorted(self.server.objects):
+            obj_container, _, name = key.partition("/")
+            if obj_container != container or not name.startswith(prefix) or name <= marker:
+                continue
+            if delimiter:
+                rest = name[len(prefix):]
+                if delimiter in rest:
+                    subdir = prefix + rest.split(delimiter)[0] + delimiter
+                    if subdir not in subdirs and subdir > marker:
+                        subdirs.add(subdir)
+                        entries.append({"subdir": subdir})
+                    continue
+            obj = self.server.objects[key]
+            entries.append({
+                "name": name,
+                "bytes": len(obj.data),
+                "hash": obj.etag,
+                "content_type": obj.content_type,
+                "last_modified": time.strftime("%Y-%m-%dT%H:%M:%S.000000", time.gmtime(obj.last_modified))
+            })
+            if len(entries) >= limit:
+                break
+        if not entries:
+            return self._send(204)
+        return self._send(200, json.dumps(entries[:limit]).encode('utf-8'), {"Content-Type": "application/json"})
+
+    def _bulk_delete(self, body):
+        deleted = not_found = 0
+        for line in body.decode('utf-8').splitlines():
+            key = unquote(line.strip()).lstrip("/")
+            if not key:
+                continue
+            with self.server.lock:
+                if self.server.objects.pop(key, None) is None:
+                    not_found += 1
+                else:
+                    deleted += 1
+        report = {
+            "Number Deleted": deleted,
+            "Number Not Found": not_found,
+            "Response Status": "200 OK",
+            "Response Body": "",
+            "Errors": []
+        }
+        return self._send(200, json.dumps(report).encode('utf-8'), {"Content-Type": "application/json"})
+
+    def _extract_archive(self, container, prefix, body, archive_format):
+        import io
+        import tarfile
+
+        mode = "r:gz" if archive_format in ("tar.gz", "tgz") else "r:"
+        created = 0
+        with tarfile.open(fileobj=io.BytesIO(body), mode=mode) as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                name = "/".join(part for part in (prefix, member.name) if part)
+                data = archive.extractfile(member).read()
+                with self.server.lock:
+                    self.server.objects[container + "/" + name] = SwiftObject(data, "application/octet-stream")
+                created += 1
+        report = {
+            "Number Files Created": created,
+            "Response Status": "201 Created",
+            "Response Body": "",
+            "Errors": []
+        }
+        return self._send(200, json.dumps(report).encode('utf-8'), {"Content-Type": "application/json"})
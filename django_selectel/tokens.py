@@ -0,0 +1,116 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LocalTokenStore(object):
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        return self._tokens.get(user)
+
+    def set(self, user, data):
+        self._tokens[user] = data
+
+    def lock(self, user):
+        return self._lock
+
+
+class DjangoCacheTokenStore(object):
+
+    def __init__(self, alias="default", key_prefix="selectel:token:", lock_timeout=30):
+        from django.core.cache import caches
+
+        self.key_prefix = key_prefix
+        self.lock_timeout = lock_timeout
+        self._cache = caches[alias]
+
+    def _key(self, user):
+        return self.key_prefix + hashlib.md5(user.encode('utf-8')).hexdigest()
+
+    def get(self, user):
+        return self._cache.get(self._key(user))
+
+    def set(self, user, data):
+        self._cache.set(self._key(user), data, max(1, int(data["expires"] - time.time())))
+
+    @contextmanager
+    def lock(self, user):
+        lock_key = self._key(user) + ":lock"
+        owner = uuid.uuid4().hex
+        deadline = time.time() + self.lock_timeout
+        # cache.add is atomic, the lock expires by itself if the holder dies
+        acquired = self._cache.add(lock_key, owner, self.lock_timeout)
+        while not acquired and time.time() <= deadline:
+            time.sleep(0.05)
+            acquired = self._cache.add(lock_key, owner, self.lock_timeout)
+        try:
+            yield
+        finally:
+            # after the timeout it runs without the lock and leaves the lock of another process alone
+            if acquired and self._cache.get(lock_key) == owner:
+                self._cache.delete(lock_key)
+
+
+class FileTokenStore(object):
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise ImportError("FileTokenStore requires fcntl")
+        self.path = path
+
+    def _path(self, user):
+        return "{}.{}".format(self.path, hashlib.md5(user.encode('utf-8')).hexdigest())
+
+    def get(self, user):
+        try:
+            with open(self._path(user)) as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, user, data):
+        path = self._path(user)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            os.chmod(tmp_path, 0o600)
+            json.dump(data, fh)
+        os.rename(tmp_path, path)
+
+    @contextmanager
+    def lock(self, user):
+        with open(self._path(user) + ".lock", "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def get_token_store(options):
+    backend = options.get("BACKEND")
+    if not backend:
+        return None
+    if backend == "local":
+        return LocalTokenStore()
+    if backend == "django":
+        return DjangoCacheTokenStore(alias=options.get("ALIAS", "default"))
+    if backend == "file":
+        return FileTokenStore(options["PATH"])
+    from django.utils.module_loading import import_string
+    return import_string(backend)(**options.get("OPTIONS", {}))
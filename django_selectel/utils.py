@@ -1,5 +1,146 @@
-
+import email.utils
 import sys
+import tarfile
+import time
+import zlib
+from datetime import datetime
 
 def is_py3():
-    return sys.version_info.major == 3
\ No newline at end of file
+    return sys.version_info.major == 3
+
+
+if is_py3():
+    text_type = str
+else:
+    text_type = unicode  # noqa: F821
+
+
+def to_bytes(value):
+    if isinstance(value, text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def rewind(fileobj):
+    try:
+        fileobj.seek(0)
+    except (AttributeError, IOError, ValueError):
+        pass
+
+
+def iter_chunks(fileobj, chunk_size):
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield to_bytes(chunk)
+
+
+def iter_hashed(chunks, hash_obj):
+    for chunk in chunks:
+        hash_obj.update(chunk)
+        yield chunk
+
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class ChunkWriter(object):
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def tar_chunks(members, compress=False, chunk_size=2 ** 20):
+    # members are (name, fileobj, size), the archive is built while it is sent
+    writer = ChunkWriter()
+    archive = tarfile.open(fileobj=writer, mode="w|gz" if compress else "w|", bufsize=chunk_size)
+    try:
+        for name, fileobj, size in members:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(time.time())
+            archive.addfile(info, fileobj)
+            for chunk in writer.drain():
+                yield chunk
+    finally:
+        archive.close()
+    for chunk in writer.drain():
+        yield chunk
+
+
+class GzipDecompressor(object):
+
+    def __init__(self, chunk_size=2 ** 20):
+        self.chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+
+    def decompress(self, chunk):
+        while chunk:
+            data = self._decompressor.decompress(chunk, self.chunk_size)
+            if data:
+                yield data
+            if self._decompressor.unconsumed_tail:
+                chunk = self._decompressor.unconsumed_tail
+            elif self._decompressor.unused_data:
+                # concatenated gzip members
+                chunk = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(GZIP_WBITS)
+            else:
+                chunk = b''
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+def parse_content_range(value):
+    # "bytes 0-99/1234" or "bytes */1234"
+    units_range, _, total = value.split(' ', 1)[-1].partition('/')
+    total = int(total) if total not in ('', '*') else None
+    if units_range == '*':
+        return None, None, total
+    first, _, last = units_range.partition('-')
+    return int(first), int(last), total
+
+
+def parse_http_date(value):
+    if not value:
+        return None
+    return datetime(*email.utils.parsedate(value)[:6])
+
+
+def object_metadata(headers):
+    original_size = headers.get('X-Object-Meta-Original-Length')
+    return {
+        "size": int(headers.get('Content-Length', 0)),
+        "etag": headers.get('ETag', '').strip('"'),
+        "content_type": headers.get('Content-Type'),
+        "last_modified": parse_http_date(headers.get('Last-Modified')),
+        "large_object": 'X-Static-Large-Object' in headers or 'X-Object-Manifest' in headers,
+        "manifest": headers.get('X-Object-Manifest'),
+        "original_size": int(original_size) if original_size else None
+    }
+
+
+def parse_listing_date(value):
+    if not value:
+        return None
+    return datetime.strptime(value.split('.')[0], "%Y-%m-%dT%H:%M:%S")
+
+
+def listing_metadata(entry):
+    return {
+        "name": entry["name"],
+        "size": int(entry.get("bytes", 0)),
+        "etag": entry.get("hash", "").strip('"'),
+        "content_type": entry.get("content_type"),
+        "last_modified": parse_listing_date(entry.get("last_modified")),
+        "large_object": "slo_etag" in entry
+    }
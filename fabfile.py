@@ -40,3 +40,8 @@ def patch():
 @task
 def tests():
     local('python -m unittest discover')
+
+
+@task
+def benchmark():
+    local('python -m benchmarks.run')
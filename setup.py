@@ -51,8 +51,12 @@ setup(
     author='KokocGroup',
     author_email='dev@kokoc.com',
     install_requires=[
-        'requests'
+        'requests',
+        'futures; python_version < "3"'
     ],
+    extras_require={
+        'async': ['aiohttp; python_version >= "3.6"']
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Environment :: Web Environment',
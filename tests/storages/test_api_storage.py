@@ -2,9 +2,22 @@
 from __future__ import unicode_literals
 
 from unittest import TestCase
-from django_selectel.storages import ApiStorage
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django_selectel.api import SelectelCDNApiException
+from django_selectel import metrics, settings
+from django_selectel.storages import ApiStorage, prefetch_file_metadata
+from django_selectel.tokens import DjangoCacheTokenStore
+import hashlib
+import hmac
+import json
 import os
+import tarfile
+import tempfile
+import time
+from functools import partial
 import gzip
+from io import BytesIO
 from mock import patch
 from StringIO import StringIO
 import requests
@@ -18,6 +31,17 @@ class HTTPResponse(object):
         self.body = content
         self.content = content
         self.headers = headers
+        self.raw = self
+
+    def stream(self, chunk_size=1, decode_content=True):
+        return self.iter_content(chunk_size)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
 
     def raise_for_status(self):
         if self.status >= 400 or self.status < 200:
@@ -35,17 +59,17 @@ class ApiSotrageTestCase(TestCase):
                     "X-Storage-Url": "https://selectel.api.com/",
                     "X-Auth-Token": 'test_token'
                 })
+            elif callable(content):
+                return content(*args, **kwargs)
             else:
                 return HTTPResponse(content, status, headers)
         return req
 
-    @patch("requests.get")
     @patch("requests.Session.get")
-    def test_get_file(self, session_mock, requests_mock):
-        test_content = 'test_content'
+    def test_get_file(self, session_mock):
+        test_content = b'test_content'
         test_path = 'container/test.txt'
 
-        requests_mock.side_effect = self.make_request(test_content)
         session_mock.side_effect = self.make_request(test_content)
 
         storage = ApiStorage(
@@ -57,7 +81,7 @@ class ApiSotrageTestCase(TestCase):
         self.assertEqual(fileobj.read(), test_content)
         self.assertEqual(fileobj.name, os.path.basename(test_path))
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch("requests.Session.put")
     @patch("requests.Session.head")
     def test_save_file(self, session_mock_head, session_mock_put, requests_mock):
@@ -76,9 +100,8 @@ class ApiSotrageTestCase(TestCase):
         path = storage.save(test_path, StringIO(test_content))
         self.assertEqual(path, test_path)
 
-    @patch("requests.get")
     @patch("requests.Session.get")
-    def test_get_file_gz(self, session_mock, requests_mock):
+    def test_get_file_gz(self, session_mock):
         test_content = 'Кирилица Cirrilic'.encode("utf-8")
         gz_file = StringIO()
         g_file_gzip = gzip.GzipFile(fileobj=gz_file, mode="wb")
@@ -88,7 +111,6 @@ class ApiSotrageTestCase(TestCase):
 
         test_path = 'container/test.txt'
 
-        requests_mock.side_effect = self.make_request(gz_file_content)
         session_mock.side_effect = self.make_request(gz_file_content)
 
         storage = ApiStorage(
@@ -101,7 +123,7 @@ class ApiSotrageTestCase(TestCase):
         self.assertEqual(fileobj.read(), test_content)
         self.assertEqual(fileobj.name, os.path.basename(test_path))
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch("requests.Session.head")
     def test_get_size_file(self, session_mock, requests_mock):
         size = 10000
@@ -118,7 +140,7 @@ class ApiSotrageTestCase(TestCase):
 
         self.assertEqual(storage.size("/test/path/text.txt"), size)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch("requests.Session.head")
     def test_exists_file(self, session_mock, requests_mock):
         requests_mock.side_effect = self.make_request("")
@@ -133,3 +155,636 @@ class ApiSotrageTestCase(TestCase):
         self.assertEqual(storage.exists("/test/path/text.txt"), True)
         session_mock.side_effect = self.make_request("", status=404)
         self.assertEqual(storage.exists("/test/path/text.txt"), False)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    @patch("requests.Session.head")
+    def test_save_file_streamed(self, session_mock_head, session_mock_put, requests_mock):
+        test_content = b'test_content' * 1000
+        sent = []
+
+        def put(*args, **kwargs):
+            sent.append(b''.join(kwargs['data']))
+            return HTTPResponse("", status=201, headers={
+                "ETag": hashlib.md5(test_content).hexdigest()
+            })
+
+        requests_mock.side_effect = self.make_request("")
+        session_mock_put.side_effect = put
+        session_mock_head.return_value = HTTPResponse("", status=200)
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+        storage._api.chunk_size = 100
+
+        storage._api.put("container", "test.txt", BytesIO(test_content))
+        self.assertEqual(sent, [test_content])
+
+        session_mock_put.side_effect = self.make_request("", status=201, headers={"ETag": "bad"})
+        with self.assertRaises(SelectelCDNApiException):
+            storage._api.put("container", "test.txt", BytesIO(test_content))
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    @patch("requests.Session.head")
+    def test_save_file_gz(self, session_mock_head, session_mock_put, requests_mock):
+        test_content = 'Кирилица Cirrilic'.encode("utf-8") * 1000
+        sent = []
+
+        def put(*args, **kwargs):
+            sent.append(b''.join(kwargs['data']))
+            return HTTPResponse("", status=201)
+
+        requests_mock.side_effect = self.make_request("")
+        session_mock_put.side_effect = put
+        session_mock_head.return_value = HTTPResponse("", status=200)
+
+        storage = ApiStorage(
+            user="test",
+            password="test",
+            use_gz=True
+        )
+        storage._api.chunk_size = 100
+
+        storage._save('container/test.txt', File(BytesIO(test_content)))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(sent[0]), mode='rb').read(), test_content)
+
+    @patch("requests.Session.get")
+    def test_get_file_range(self, session_mock):
+        test_content = os.urandom(2 ** 20)
+        test_path = 'container/test.bin'
+        ranges = []
+
+        def get(*args, **kwargs):
+            first, last = kwargs['headers']['Range'][len('bytes='):].split('-')
+            first, last = int(first), min(int(last or len(test_content)), len(test_content) - 1)
+            ranges.append((first, last))
+            return HTTPResponse(test_content[first:last + 1], status=206, headers={
+                "Content-Range": "bytes {}-{}/{}".format(first, last, len(test_content))
+            })
+
+        session_mock.side_effect = self.make_request(get)
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+
+        fileobj = storage.open(test_path)
+        self.assertEqual(fileobj.read(16), test_content[:16])
+        fileobj.seek(-100, os.SEEK_END)
+        self.assertEqual(fileobj.read(), test_content[-100:])
+        self.assertEqual(len(ranges), 2)
+        self.assertLess(sum(last - first + 1 for first, last in ranges), 2 ** 18)
+
+        fileobj.seek(0)
+        self.assertEqual(fileobj.read(), test_content)
+        self.assertEqual(len(ranges), 3)
+
+        fileobj.seek(1000)
+        self.assertEqual(fileobj.read(2 ** 19), test_content[1000:1000 + 2 ** 19])
+        self.assertEqual(len(ranges), 4)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    @patch("requests.Session.head")
+    def test_save_file_segmented(self, session_mock_head, session_mock_put, requests_mock):
+        test_content = os.urandom(1000)
+        sent = {}
+
+        def put(url, data=None, params=None, headers=None, **kwargs):
+            if params:
+                sent['manifest'] = json.loads(data)
+                return HTTPResponse("", status=201)
+            if url not in sent:
+                # every segment fails once and is sent again
+                sent[url] = b''.join(data)
+                return HTTPResponse("", status=500)
+            sent[url] = b''.join(data)
+            return HTTPResponse("", status=201, headers={"ETag": hashlib.md5(sent[url]).hexdigest()})
+
+        requests_mock.side_effect = self.make_request("")
+        session_mock_put.side_effect = put
+        session_mock_head.return_value = HTTPResponse("", status=200)
+
+        with patch.dict(settings.SELECTEL_STORAGE, SEGMENT_THRESHOLD=500, SEGMENT_SIZE=300, API_RETRY_DELAY=0):
+            storage = ApiStorage(
+                user="test",
+                password="test"
+            )
+            storage._save('container/test.bin', File(BytesIO(test_content)))
+
+        segments = sent.pop('manifest')
+        self.assertEqual([segment['size_bytes'] for segment in segments], [300, 300, 300, 100])
+        self.assertEqual(
+            b''.join(sent['https://selectel.api.com' + segment['path']] for segment in segments),
+            test_content
+        )
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    def test_download_file(self, session_mock_head, session_mock_get):
+        test_content = os.urandom(1000)
+        ranges = []
+
+        def get(*args, **kwargs):
+            first, last = map(int, kwargs['headers']['Range'][len('bytes='):].split('-'))
+            ranges.append((first, last))
+            return HTTPResponse(test_content[first:last + 1], status=206, headers={
+                "Content-Range": "bytes {}-{}/{}".format(first, last, len(test_content))
+            })
+
+        session_mock_get.side_effect = self.make_request(get)
+        session_mock_head.return_value = HTTPResponse("", status=200, headers={
+            "Content-Length": len(test_content),
+            "ETag": hashlib.md5(test_content).hexdigest()
+        })
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+
+        local_path = os.path.join(tempfile.mkdtemp(), 'test.bin')
+        with patch.dict(settings.SELECTEL_STORAGE, DOWNLOAD_PART_SIZE=300):
+            storage.download('container/test.bin', local_path)
+        with open(local_path, 'rb') as fh:
+            self.assertEqual(fh.read(), test_content)
+        self.assertEqual(sorted(ranges), [(0, 299), (300, 599), (600, 899), (900, 999)])
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    @patch("requests.Session.delete")
+    def test_metadata_cache(self, session_mock_delete, session_mock_head, requests_mock):
+        requests_mock.side_effect = self.make_request("")
+        session_mock_head.side_effect = self.make_request("", headers={
+            "Content-Length": 100
+        })
+        session_mock_delete.return_value = HTTPResponse("", status=204)
+
+        with patch.dict(settings.SELECTEL_STORAGE, METADATA_CACHE={"BACKEND": "memory"}):
+            storage = ApiStorage(
+                user="test",
+                password="test"
+            )
+
+        self.assertEqual(storage.exists("container/text.txt"), True)
+        self.assertEqual(storage.size("container/text.txt"), 100)
+        self.assertEqual(session_mock_head.call_count, 1)
+
+        storage.delete("container/text.txt")
+        self.assertEqual(storage.exists("container/text.txt"), False)
+        self.assertEqual(session_mock_head.call_count, 1)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    @patch("requests.Session.head")
+    def test_save_file_verify(self, session_mock_head, session_mock_put, requests_mock):
+        requests_mock.side_effect = self.make_request("")
+        session_mock_put.side_effect = self.make_request("", status=201)
+        session_mock_head.return_value = HTTPResponse("", status=404)
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+
+        storage._api.put("container", "test.txt", b"test_content")
+        self.assertEqual(session_mock_head.call_count, 0)
+
+        storage._api.put_verify = "head"
+        with self.assertRaises(SelectelCDNApiException):
+            storage._api.put("container", "test.txt", b"test_content")
+
+    @patch("requests.Session.get")
+    def test_listdir(self, session_mock):
+        pages = [
+            [{"subdir": "dir/a/"}, {"name": "dir/b.txt", "bytes": 10, "hash": "x", "content_type": "text/plain",
+                                    "last_modified": "2018-01-01T10:00:00.000000"}],
+            [{"name": "dir/c.txt", "bytes": 20, "hash": "y", "content_type": "text/plain",
+              "last_modified": "2018-01-01T10:00:00.000000"}],
+        ]
+        params = []
+
+        def get(*args, **kwargs):
+            params.append(kwargs['params'])
+            response = HTTPResponse(json.dumps(pages[len(params) - 1]))
+            response.json = lambda: json.loads(response.content)
+            return response
+
+        session_mock.side_effect = self.make_request(get)
+
+        with patch.dict(settings.SELECTEL_STORAGE, METADATA_CACHE={"BACKEND": "memory"}):
+            storage = ApiStorage(
+                user="test",
+                password="test"
+            )
+        storage._api.list_container = partial(storage._api.list_container, limit=2)
+
+        self.assertEqual(storage.listdir("container/dir"), (["a"], ["b.txt", "c.txt"]))
+        self.assertEqual([p.get("marker") for p in params], [None, "dir/b.txt"])
+        self.assertEqual(params[0]["prefix"], "dir/")
+        self.assertEqual(storage.size("container/dir/c.txt"), 20)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.post")
+    @patch("requests.Session.delete")
+    def test_delete_many(self, session_mock_delete, session_mock_post, requests_mock):
+        bodies = []
+
+        def post(*args, **kwargs):
+            bodies.append(kwargs['data'])
+            response = HTTPResponse(json.dumps({
+                "Response Status": "400 Bad Request",
+                "Errors": [["/container/b.txt", "409 Conflict"]]
+            }))
+            response.json = lambda: json.loads(response.content)
+            return response
+
+        requests_mock.side_effect = self.make_request("")
+        session_mock_post.side_effect = post
+        session_mock_delete.return_value = HTTPResponse("", status=204)
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+        storage._api.bulk_delete_size = 2
+
+        results = storage.delete_many(["container/a.txt", "container/b.txt", "container/c d.txt"])
+        self.assertEqual(results, {"container/a.txt": 204, "container/b.txt": 409, "container/c d.txt": 204})
+        self.assertEqual(len(bodies), 2)
+        self.assertEqual(bodies[1], b"/container/c%20d.txt")
+        self.assertEqual(session_mock_delete.call_count, 0)
+
+        session_mock_post.side_effect = None
+        session_mock_post.return_value = HTTPResponse("", status=404)
+        storage._api._bulk_delete_supported = None
+        results = storage.delete_many(["container/a.txt", "container/b.txt"])
+        self.assertEqual(results, {"container/a.txt": 204, "container/b.txt": 204})
+        self.assertEqual(session_mock_delete.call_count, 2)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    def test_token_refresh(self, session_mock_head, session_mock_get):
+        session_mock_get.side_effect = self.make_request("")
+        session_mock_head.side_effect = [HTTPResponse("", status=401), HTTPResponse("", status=200)]
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+        session = storage._api._session
+
+        self.assertEqual(storage.exists("container/text.txt"), True)
+        self.assertEqual(session_mock_get.call_count, 2)
+        self.assertIs(storage._api._session, session)
+        self.assertEqual(session.headers["X-Auth-Token"], "test_token")
+
+        storage._api.authenticate(stale_token="old_token")
+        self.assertEqual(session_mock_get.call_count, 2)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    def test_metrics_hooks(self, session_mock_head, session_mock_get):
+        session_mock_get.side_effect = self.make_request(b"test content")
+        session_mock_head.side_effect = [
+            HTTPResponse("", status=401), HTTPResponse("", status=500), HTTPResponse("", status=200)
+        ]
+
+        metrics.aggregator.reset()
+        with patch.dict(settings.SELECTEL_STORAGE, METRICS_HOOKS=["aggregator"], API_RETRY_DELAY=0):
+            storage = ApiStorage(user="test", password="test")
+
+        self.assertEqual(storage.exists("container/text.txt"), True)
+        self.assertEqual(storage._read("container/text.txt"), b"test content")
+        snapshot = metrics.aggregator.snapshot()
+        self.assertEqual(snapshot["requests"], {("head", 200): 1, ("get", 200): 1})
+        self.assertEqual(snapshot["retries"], {"head": 1, "get": 0})
+        self.assertEqual(snapshot["auth_refreshes"], 2)
+        self.assertEqual(snapshot["bytes"], {"head": 0, "get": len(b"test content")})
+        self.assertEqual(snapshot["durations"]["head"]["count"], 1)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    @patch("requests.Session.head")
+    def test_retry_policy(self, session_mock_head, session_mock_put, session_mock_get):
+        session_mock_get.side_effect = self.make_request("", status=404)
+        session_mock_put.side_effect = self.make_request("", status=500)
+        session_mock_head.side_effect = [
+            HTTPResponse("", status=503), requests.exceptions.ConnectionError(), HTTPResponse("", status=200)
+        ]
+
+        with patch.dict(settings.SELECTEL_STORAGE, API_RETRY_DELAY=0, API_BREAKER_THRESHOLD=3):
+            storage = ApiStorage(user="test", password="test", overwrite_files=True)
+
+        self.assertEqual(storage.exists("container/text.txt"), True)
+        self.assertEqual(session_mock_head.call_count, 3)
+        with self.assertRaises(SelectelCDNApiException):
+            storage._read("container/text.txt")
+        self.assertEqual(session_mock_get.call_count, 2)
+        session_mock_get.side_effect = [requests.exceptions.ChunkedEncodingError(), HTTPResponse(b"test")]
+        self.assertEqual(storage._read("container/text.txt"), b"test")
+        self.assertEqual(session_mock_get.call_count, 4)
+        with self.assertRaises(SelectelCDNApiException):
+            storage.save("container/text.txt", ContentFile(b"test"))
+        self.assertEqual(session_mock_put.call_count, 1)
+
+        # the circuit breaker opens after three failed attempts in a row
+        session_mock_head.side_effect = requests.exceptions.ConnectionError()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            storage._api._head("container", "text.txt")
+        self.assertEqual(session_mock_head.call_count, 6)
+        with self.assertRaises(SelectelCDNApiException):
+            storage._api._head("container", "text.txt")
+        self.assertEqual(session_mock_head.call_count, 6)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    def test_hedged_requests(self, session_mock_head, session_mock_get):
+        session_mock_get.side_effect = self.make_request("")
+        delays = [0] * 20 + [1, 0]
+
+        def head(*args, **kwargs):
+            time.sleep(delays.pop(0))
+            return HTTPResponse("", status=200)
+
+        session_mock_head.side_effect = head
+
+        with patch.dict(settings.SELECTEL_STORAGE, API_HEDGE=True):
+            storage = ApiStorage(user="test", password="test")
+
+        for i in range(20):
+            storage._api._head("container", "text.txt")
+        started = time.time()
+        storage._api._head("container", "text.txt")
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(session_mock_head.call_count, 22)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    def test_save_many(self, session_mock_put, session_mock_get):
+        session_mock_get.side_effect = self.make_request("")
+
+        def put(url, params=None, data=None, **kwargs):
+            with tarfile.open(fileobj=BytesIO(b"".join(data)), mode="r|") as archive:
+                names = [member.name for member in archive]
+            self.assertEqual(names, ["a.txt", "dir/b.txt"])
+            self.assertEqual(params, {"extract-archive": "tar"})
+            response = HTTPResponse(json.dumps({
+                "Number Files Created": 1,
+                "Response Status": "400 Bad Request",
+                "Response Body": "",
+                "Errors": [["/v1/SEL_1/container/dir/b.txt", "413 Request Entity Too Large"]]
+            }))
+            response.json = lambda: json.loads(response.content)
+            return response
+
+        session_mock_put.side_effect = put
+        storage = ApiStorage(user="test", password="test")
+        self.assertEqual(storage.save_many([
+            ("container/a.txt", ContentFile(b"a")),
+            ("container/dir/b.txt", b"b")
+        ]), {"container/a.txt": 201, "container/dir/b.txt": 413})
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    def test_token_store(self, session_mock_head, session_mock_get):
+        session_mock_get.side_effect = self.make_request("")
+        session_mock_head.side_effect = self.make_request("")
+
+        token_path = os.path.join(tempfile.mkdtemp(), 'token')
+        with patch.dict(settings.SELECTEL_STORAGE, TOKEN_STORE={"BACKEND": "file", "PATH": token_path}):
+            storages = [ApiStorage(user="test", password="test") for i in range(3)]
+
+        for storage in storages:
+            self.assertEqual(storage.exists("container/text.txt"), True)
+            self.assertEqual(storage._api._session.headers["X-Auth-Token"], "test_token")
+        self.assertEqual(session_mock_get.call_count, 1)
+
+    def test_django_cache_token_lock(self):
+        holder = DjangoCacheTokenStore(lock_timeout=5)
+        waiter = DjangoCacheTokenStore(lock_timeout=0.1)
+        lock_key = holder._key("test") + ":lock"
+
+        with holder.lock("test"):
+            with waiter.lock("test"):
+                pass
+            self.assertIsNotNone(holder._cache.get(lock_key))
+        self.assertIsNone(holder._cache.get(lock_key))
+
+    @patch("requests.Session.get")
+    def test_url(self, session_mock):
+        with patch.dict(settings.SELECTEL_STORAGE, STORAGE_URL="https://selectel.api.com/", TEMP_URL_KEY="secret"):
+            storage = ApiStorage(
+                user="test",
+                password="test"
+            )
+            self.assertEqual(storage.url("container/dir/test.txt"), "https://selectel.api.com/container/dir/test.txt")
+            with patch("time.time", return_value=1000):
+                url = storage.signed_url("container/dir/test file.txt", expires=100)
+
+        signature = hmac.new(b"secret", b"GET\n1100\n/container/dir/test file.txt", hashlib.sha1).hexdigest()
+        self.assertEqual(
+            url,
+            "https://selectel.api.com/container/dir/test%20file.txt?temp_url_sig={}&temp_url_expires=1100".format(signature)
+        )
+        self.assertEqual(session_mock.call_count, 0)
+
+    @patch("requests.Session.get")
+    def test_upload_form(self, session_mock):
+        with patch.dict(settings.SELECTEL_STORAGE, STORAGE_URL="https://selectel.api.com/", TEMP_URL_KEY="secret"):
+            storage = ApiStorage(
+                user="test",
+                password="test"
+            )
+            with patch("time.time", return_value=1000):
+                form = storage.upload_form("container/uploads/", max_file_size=1024, max_file_count=2,
+                                           redirect="https://mysite.com/")
+
+        signature = hmac.new(
+            b"secret", b"/container/uploads/\nhttps://mysite.com/\n1024\n2\n4600", hashlib.sha1
+        ).hexdigest()
+        self.assertEqual(form["url"], "https://selectel.api.com/container/uploads/")
+        self.assertEqual(form["fields"]["signature"], signature)
+        self.assertEqual(form["fields"]["expires"], 4600)
+        self.assertEqual(session_mock.call_count, 0)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    @patch("requests.Session.delete")
+    def test_copy_many(self, session_mock_delete, session_mock_put, session_mock_get):
+        copied = []
+
+        def put(url, headers=None, **kwargs):
+            copied.append((headers["X-Copy-From"], url))
+            return HTTPResponse("", status=404 if "missing" in url else 201)
+
+        session_mock_get.side_effect = self.make_request("")
+        session_mock_put.side_effect = put
+        session_mock_delete.return_value = HTTPResponse("", status=204)
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+
+        results = storage.copy_many([
+            ("temp/a.txt", "public/a.txt"),
+            ("temp/b.txt", "public/missing.txt"),
+        ], move=True)
+        self.assertEqual(results, {"public/a.txt": 201, "public/missing.txt": 404})
+        self.assertIn(("/temp/a.txt", "https://selectel.api.com/public/a.txt"), copied)
+        self.assertEqual(session_mock_delete.call_count, 1)
+
+    @patch("requests.Session.get")
+    def test_disk_cache(self, session_mock):
+        test_content = b'test_content'
+        etag = hashlib.md5(test_content).hexdigest()
+        conditional = []
+
+        def get(*args, **kwargs):
+            conditional.append(kwargs['headers'].get("If-None-Match"))
+            if conditional[-1] == etag:
+                return HTTPResponse(b"", status=304)
+            return HTTPResponse(test_content, headers={"ETag": etag})
+
+        session_mock.side_effect = self.make_request(get)
+
+        with patch.dict(settings.SELECTEL_STORAGE, DISK_CACHE={"PATH": tempfile.mkdtemp()}):
+            storage = ApiStorage(
+                user="test",
+                password="test"
+            )
+
+        for i in range(3):
+            fileobj = storage.open('container/test.txt')
+            self.assertEqual(fileobj.read(), test_content)
+            fileobj.close()
+        self.assertEqual(conditional, [None, etag, etag])
+
+        storage._disk_cache.freshness = 60
+        self.assertEqual(storage.open('container/test.txt').read(), test_content)
+        self.assertEqual(len(conditional), 3)
+
+        # a file larger than the cache is returned and evicted by the next file
+        storage._disk_cache.max_size = 5
+        self.assertEqual(storage.open('container/other.txt').read(), test_content)
+        self.assertEqual(storage.open('container/test.txt').read(), test_content)
+        self.assertEqual(len(conditional), 5)
+
+    @patch("requests.Session.get")
+    def test_get_file_spooled(self, session_mock):
+        test_content = b'line\n' * 100000
+        gz_file = BytesIO()
+        g_file_gzip = gzip.GzipFile(fileobj=gz_file, mode="wb")
+        g_file_gzip.write(test_content)
+        g_file_gzip.close()
+
+        session_mock.side_effect = self.make_request(gz_file.getvalue())
+
+        storage = ApiStorage(
+            user="test",
+            password="test",
+            use_gz=True
+        )
+
+        with patch.dict(settings.SELECTEL_STORAGE, SPOOL_MAX_SIZE=1024):
+            fileobj = storage.open('container/test.txt')
+            self.assertEqual(fileobj.file.readline(), b'line\n')
+        self.assertEqual(bytes(fileobj.getbuffer()), test_content)
+        self.assertEqual(fileobj.content, test_content)
+        fileobj.seek(0)
+        fileobj.write(b'LINE')
+        self.assertEqual(fileobj.content[:10], b'LINE\nline\n')
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    def test_prefetch_metadata(self, session_mock_head, session_mock_get):
+        session_mock_get.side_effect = self.make_request("")
+        session_mock_head.side_effect = self.make_request("", headers={"Content-Length": 100})
+
+        with patch.dict(settings.SELECTEL_STORAGE, METADATA_CACHE={"BACKEND": "memory"}):
+            storage = ApiStorage(
+                user="test",
+                password="test"
+            )
+
+        class FieldFile(object):
+            def __init__(self, name):
+                self.name = name
+                self.storage = storage
+
+        class Instance(object):
+            def __init__(self, i):
+                self.file = FieldFile("container/{}.txt".format(i % 10))
+
+        instances = prefetch_file_metadata((Instance(i) for i in range(20)), "file")
+        self.assertEqual(len(instances), 20)
+        self.assertEqual(session_mock_head.call_count, 10)
+        self.assertEqual([storage.size(instance.file.name) for instance in instances], [100] * 20)
+        self.assertEqual(session_mock_head.call_count, 10)
+
+        # without a metadata cache only the prefetched files are kept
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+        instances = prefetch_file_metadata((Instance(i) for i in range(20)), "file")
+        self.assertEqual(session_mock_head.call_count, 20)
+        self.assertEqual([storage.exists(instance.file.name) for instance in instances], [True] * 20)
+        self.assertEqual(storage.size("container/0.txt"), 100)
+        self.assertEqual(session_mock_head.call_count, 20)
+        storage.exists("container/other.txt")
+        storage.exists("container/other.txt")
+        self.assertEqual(session_mock_head.call_count, 22)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.put")
+    @patch("requests.Session.head")
+    def test_save_file_conditional_name(self, session_mock_head, session_mock_put, session_mock_get):
+        urls = []
+
+        def put(url, headers=None, **kwargs):
+            urls.append(url)
+            self.assertEqual(headers["If-None-Match"], "*")
+            return HTTPResponse("", status=412 if len(urls) == 1 else 201)
+
+        session_mock_get.side_effect = self.make_request("")
+        session_mock_put.side_effect = put
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+        storage._api.max_retry = None
+
+        with patch.dict(settings.SELECTEL_STORAGE, NAME_STRATEGY="conditional"):
+            name = storage.save("container/test.txt", ContentFile(b"test_content"))
+        self.assertNotEqual(name, "container/test.txt")
+        self.assertTrue(name.startswith("container/test_") and name.endswith(".txt"))
+        self.assertEqual(urls[-1], "https://selectel.api.com/" + name)
+        self.assertEqual(session_mock_head.call_count, 0)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.head")
+    def test_available_name_listing(self, session_mock_head, session_mock_get):
+        def get(*args, **kwargs):
+            response = HTTPResponse(json.dumps([{"name": "dir/test.txt"}, {"name": "dir/test_1.txt"}]))
+            response.json = lambda: json.loads(response.content)
+            return response
+
+        session_mock_get.side_effect = self.make_request(get)
+
+        storage = ApiStorage(
+            user="test",
+            password="test"
+        )
+
+        with patch.dict(settings.SELECTEL_STORAGE, NAME_STRATEGY="listing"):
+            self.assertEqual(storage.get_available_name("container/dir/new.txt"), "container/dir/new.txt")
+            name = storage.get_available_name("container/dir/test.txt")
+        self.assertTrue(name.startswith("container/dir/test_") and name != "container/dir/test_1.txt")
+        self.assertEqual(session_mock_head.call_count, 0)
@@ -0,0 +1,128 @@
+# coding=utf-8
+import gzip
+import hashlib
+import sys
+import unittest
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from django_selectel import settings
+from django_selectel.api import SelectelCDNApiException
+from mock import patch
+
+
+@unittest.skipIf(web is None or sys.version_info < (3, 8), "aiohttp and Python 3.8+ are required")
+class AsyncApiStorageTestCase(unittest.IsolatedAsyncioTestCase if sys.version_info >= (3, 8) else object):
+
+    async def asyncSetUp(self):
+        self.objects = {}
+        self.headers = {}
+        self.auth_count = 0
+        self.put_errors = 0
+        self.requests = []
+
+        async def auth(request):
+            self.auth_count += 1
+            return web.Response(status=204, headers={
+                "X-Expire-Auth-Token": "3600",
+                "X-Storage-Url": "http://127.0.0.1:{}/".format(self.port),
+                "X-Auth-Token": "test_token"
+            })
+
+        async def handle(request):
+            key = request.match_info['path']
+            self.requests.append((request.method, key))
+            if request.method == 'PUT':
+                body = await request.read()
+                if self.put_errors:
+                    self.put_errors -= 1
+                    return web.Response(status=503)
+                self.objects[key] = body
+                self.headers[key] = dict(
+                    (name, value) for name, value in request.headers.items()
+                    if name in ("Content-Encoding", "X-Object-Meta-Original-Length")
+                )
+                return web.Response(status=201, headers={"ETag": hashlib.md5(body).hexdigest()})
+            if key not in self.objects:
+                return web.Response(status=404)
+            if request.method == 'DELETE':
+                del self.objects[key]
+                return web.Response(status=204)
+            body = self.objects[key]
+            headers = {"ETag": hashlib.md5(body).hexdigest(), "Content-Length": str(len(body))}
+            headers.update(self.headers.get(key, {}))
+            if request.method == 'HEAD':
+                return web.Response(status=200, headers=headers)
+            return web.Response(body=body, headers=headers)
+
+        # the storage keeps compressed bodies as they are sent
+        app = web.Application(handler_args={"auto_decompress": False})
+        app.router.add_get('/auth/', auth)
+        app.router.add_route('*', '/{path:.+}', handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def test_save_read_delete(self):
+        from django_selectel.storages.async_storage import AsyncApiStorage
+
+        test_content = 'Кирилица Cirrilic'.encode("utf-8") * 1000
+        auth_url = "http://127.0.0.1:{}/auth/".format(self.port)
+        with patch.dict(settings.SELECTEL_STORAGE, AUTH_URL=auth_url):
+            storage = AsyncApiStorage(user="test", password="test", use_gz=True)
+        async with storage:
+            names = await storage._api.gather([
+                storage.save("container/test_{}.txt".format(i), test_content) for i in range(10)
+            ])
+            self.assertEqual(gzip.decompress(self.objects["container/test_0.txt"]), test_content)
+            self.assertEqual(await storage.read(names[0]), test_content)
+            self.assertEqual(await storage.exists(names[0]), True)
+            self.assertEqual(await storage.size(names[0]), len(test_content))
+            await storage.delete_many(names)
+            self.assertEqual(self.objects, {})
+            self.assertEqual(await storage.exists(names[0]), False)
+        self.assertEqual(self.auth_count, 1)
+
+    async def test_save_retry(self):
+        from django_selectel.storages.async_storage import AsyncApiStorage
+
+        test_content = b"hello world " * 100
+        auth_url = "http://127.0.0.1:{}/auth/".format(self.port)
+        with patch.dict(settings.SELECTEL_STORAGE, AUTH_URL=auth_url, API_MAX_RETRY=3, API_RETRY_DELAY=0):
+            storage = AsyncApiStorage(user="test", password="test", use_gz=True, overwrite_files=True)
+        async with storage:
+            self.put_errors = 1
+            name = await storage.save("container/a.txt", test_content)
+            self.assertEqual(self.put_errors, 0)
+            self.assertEqual(gzip.decompress(self.objects[name]), test_content)
+            self.assertEqual(await storage.read(name), test_content)
+
+            async def chunks():
+                yield test_content
+
+            # an async iterator can not be sent again
+            self.put_errors = 1
+            with self.assertRaises(SelectelCDNApiException):
+                await storage.save("container/b.txt", chunks())
+            self.assertNotIn("container/b.txt", self.objects)
+
+    async def test_retry_policy(self):
+        from django_selectel.storages.async_storage import AsyncApiStorage
+
+        auth_url = "http://127.0.0.1:{}/auth/".format(self.port)
+        with patch.dict(settings.SELECTEL_STORAGE, AUTH_URL=auth_url, API_MAX_RETRY=3, API_RETRY_DELAY=0):
+            storage = AsyncApiStorage(user="test", password="test")
+        async with storage:
+            self.assertEqual(storage._api.session.timeout.sock_read, 60)
+            # a missing file is not requested again
+            with self.assertRaises(SelectelCDNApiException):
+                await storage.read("container/missing.txt")
+            self.assertEqual(self.requests, [("GET", "container/missing.txt")])
@@ -0,0 +1,79 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from mock import patch
+
+from django_selectel import metrics, settings
+from django_selectel.storages.static_storage import ManifestStaticApiStorage, StaticApiStorage
+from django_selectel.testing import SwiftStandInServer
+
+
+class StaticApiStorageTestCase(TestCase):
+
+    def setUp(self):
+        self.server = SwiftStandInServer().start()
+        self.addCleanup(self.server.stop)
+        patcher = patch.dict(settings.SELECTEL_STORAGE, AUTH_URL=self.server.auth_url, METRICS_HOOKS=["aggregator"])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.aggregator.reset()
+
+    def collect(self, storage, files):
+        # the calls collectstatic makes for each file
+        for name, content in files.items():
+            if storage.exists(name):
+                storage.get_modified_time(name)
+                storage.delete(name)
+            storage.save(name, ContentFile(content))
+        return list(storage.post_process(dict((name, None) for name in files)))
+
+    def uploads(self):
+        return metrics.aggregator.snapshot()["requests"].get(("put", 201), 0)
+
+    def test_collect_incremental(self):
+        self.collect(StaticApiStorage(user="test", password="test"), {
+            "css/a.css": b"body {}",
+            "js/b.js": b"var b;",
+            "js/old.js": b"var old;"
+        })
+        self.assertEqual(self.uploads(), 3)
+
+        with patch.dict(settings.SELECTEL_STORAGE, STATIC_DELETE_STALE=True):
+            self.collect(StaticApiStorage(user="test", password="test"), {
+                "css/a.css": b"body {}",
+                "js/b.js": b"var b = 1;",
+                "js/c.js": b"var c;"
+            })
+        self.assertEqual(self.uploads(), 5)
+        self.assertEqual(sorted(self.server.objects), ["static/css/a.css", "static/js/b.js", "static/js/c.js"])
+        self.assertEqual(self.server.objects["static/js/b.js"].data, b"var b = 1;")
+
+    def test_collect_manifest(self):
+        source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        source = FileSystemStorage(location=source_dir)
+        source.save("css/a.css", ContentFile(b'body { background: url("../img/b.png"); }'))
+        source.save("img/b.png", ContentFile(b"png"))
+
+        storage = ManifestStaticApiStorage(user="test", password="test")
+        for name in ("css/a.css", "img/b.png"):
+            with source.open(name) as fh:
+                storage.save(name, fh)
+        paths = {"css/a.css": (source, "css/a.css"), "img/b.png": (source, "img/b.png")}
+        processed = list(storage.post_process(paths))
+
+        self.assertEqual(len(processed), 2)
+        manifest = json.loads(self.server.objects["static/staticfiles.json"].data.decode("utf-8"))
+        hashed_css = manifest["paths"]["css/a.css"]
+        hashed_png = manifest["paths"]["img/b.png"]
+        self.assertIn(hashed_png.split("/")[-1].encode("utf-8"), self.server.objects["static/" + hashed_css].data)
+
+        storage = ManifestStaticApiStorage(user="test", password="test")
+        self.assertEqual(storage.stored_name("css/a.css"), hashed_css)
@@ -0,0 +1,167 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from django.core.files.base import ContentFile
+from mock import patch
+
+from django_selectel import settings
+from django_selectel.api import SelectelCDNApiException
+from django_selectel.storages import ApiStorage
+from django_selectel.testing import SwiftObject, SwiftStandInServer
+
+
+class SwiftStandInServerTestCase(TestCase):
+
+    def setUp(self):
+        self.server = SwiftStandInServer().start()
+        self.addCleanup(self.server.stop)
+
+    def make_storage(self, **kwargs):
+        with patch.dict(settings.SELECTEL_STORAGE, AUTH_URL=self.server.auth_url):
+            return ApiStorage(user="test", password="test", **kwargs)
+
+    def test_storage_roundtrip(self):
+        storage = self.make_storage(overwrite_files=True)
+        test_content = os.urandom(300 * 1024)
+
+        name = storage.save("container/dir/test.bin", ContentFile(test_content))
+        self.assertEqual(storage.size(name), len(test_content))
+        with storage.open(name) as fileobj:
+            fileobj.seek(-10, os.SEEK_END)
+            self.assertEqual(fileobj.read(), test_content[-10:])
+            fileobj.seek(0)
+            self.assertEqual(fileobj.read(), test_content)
+
+        storage.copy(name, "container/dir/copy.bin")
+        self.assertEqual(storage.listdir("container/dir"), ([], ["copy.bin", "test.bin"]))
+        self.assertEqual(storage.delete_many(["container/dir/test.bin", "container/dir/copy.bin"]), {
+            "container/dir/test.bin": 204,
+            "container/dir/copy.bin": 204
+        })
+        self.assertEqual(self.server.objects, {})
+
+    def test_storage_gz(self):
+        storage = self.make_storage(use_gz=True)
+        test_content = 'Кирилица Cirrilic\n'.encode("utf-8") * 10000
+
+        name = storage.save("container/test.txt", ContentFile(test_content))
+        self.assertLess(len(self.server.objects[name].data), len(test_content))
+        with storage.open(name) as fileobj:
+            self.assertEqual(fileobj.read(), test_content)
+
+    def test_storage_compression(self):
+        text_content = b"body { color: red; }\n" * 1000
+        image_content = os.urandom(10 * 1024)
+
+        with patch.dict(settings.SELECTEL_STORAGE, COMPRESSION={"CODEC": "gzip", "LEVEL": 9, "MIN_SIZE": 1024}):
+            storage = self.make_storage(use_gz=True)
+            css = storage.save("container/a.css", ContentFile(text_content))
+            small = storage.save("container/small.css", ContentFile(b"a {}"))
+            image = storage.save("container/b.jpg", ContentFile(image_content))
+
+        self.assertEqual(self.server.objects[css].headers["Content-Encoding"], "gzip")
+        self.assertEqual(self.server.objects[css].headers["X-Object-Meta-Original-Length"], str(len(text_content)))
+        self.assertNotIn("Content-Encoding", self.server.objects[small].headers)
+        self.assertNotIn("Content-Encoding", self.server.objects[image].headers)
+        self.assertEqual(self.server.objects[image].data, image_content)
+        self.assertEqual(storage.size(css), len(text_content))
+        with patch.dict(settings.SELECTEL_STORAGE, METADATA_CACHE={"BACKEND": "memory"}):
+            storage = self.make_storage(use_gz=True)
+        self.assertEqual(storage.size(css), len(text_content))
+        storage.listdir("container")
+        self.assertEqual(storage.size(css), len(text_content))
+        self.assertEqual(storage.size(image), len(image_content))
+        for name, content in ((css, text_content), (small, b"a {}"), (image, image_content)):
+            with storage.open(name) as fileobj:
+                self.assertEqual(fileobj.read(), content)
+
+    def test_storage_segments(self):
+        for manifest in ("static", "dynamic"):
+            with patch.dict(settings.SELECTEL_STORAGE, SEGMENT_THRESHOLD=1000, SEGMENT_SIZE=400,
+                            SEGMENT_MANIFEST=manifest, NAME_STRATEGY="conditional"):
+                storage = self.make_storage()
+                for i in range(2):
+                    storage.save("container/big.bin", ContentFile(os.urandom(1500)))
+                overwrite = self.make_storage(overwrite_files=True)
+                content = os.urandom(1500)
+                overwrite.save("container/big.bin", ContentFile(content))
+                with overwrite.open("container/big.bin") as fileobj:
+                    self.assertEqual(fileobj.read(), content)
+
+                # four segments for each of the two files, the replaced ones are deleted
+                segments = [key for key in self.server.objects if "/.segments/" in "/" + key]
+                self.assertEqual(len(segments), 8)
+                directories, files = storage.listdir("container")
+                self.assertEqual(directories, [])
+                self.assertEqual(len(files), 2)
+
+                storage.delete("container/big.bin")
+                storage.delete_many(["container/" + name for name in files if name != "big.bin"])
+            self.assertEqual(self.server.objects, {})
+
+    def test_storage_disk_cache_eviction(self):
+        with patch.dict(settings.SELECTEL_STORAGE, DISK_CACHE={"PATH": tempfile.mkdtemp(), "MAX_SIZE": 250}):
+            storage = self.make_storage()
+        self.addCleanup(shutil.rmtree, storage._disk_cache.path)
+        for name in ("a", "b", "c"):
+            self.server.objects["container/" + name] = SwiftObject(name.encode("utf-8") * 100, "text/plain")
+
+        # the revalidated file is the most recently used one
+        for name in ("a", "b", "a", "c"):
+            with storage.open("container/" + name) as fileobj:
+                self.assertEqual(fileobj.read(), name.encode("utf-8") * 100)
+            time.sleep(0.01)
+        cached = [
+            name for name in ("a", "b", "c")
+            if os.path.exists(storage._disk_cache._paths("container/" + name)[0])
+        ]
+        self.assertEqual(cached, ["a", "c"])
+
+    def test_storage_disk_cache_invalidation(self):
+        with patch.dict(settings.SELECTEL_STORAGE, DISK_CACHE={"PATH": tempfile.mkdtemp(), "FRESHNESS": 60}):
+            storage = self.make_storage(overwrite_files=True)
+        self.addCleanup(shutil.rmtree, storage._disk_cache.path)
+
+        def read(name):
+            with storage.open(name) as fileobj:
+                return fileobj.read()
+
+        for name, content in (("a", b"old"), ("src", b"new"), ("dst", b"dst-old"), ("copy", b"copy-old")):
+            storage.save("container/" + name, ContentFile(content))
+            self.assertEqual(read("container/" + name), content)
+
+        storage.delete_many(["container/a"])
+        self.assertFalse(storage.exists("container/a"))
+        with self.assertRaises(SelectelCDNApiException):
+            read("container/a")
+        storage.copy("container/src", "container/copy")
+        self.assertEqual(read("container/copy"), b"new")
+        storage.move("container/src", "container/dst")
+        self.assertEqual(read("container/dst"), b"new")
+        with self.assertRaises(SelectelCDNApiException):
+            read("container/src")
+        storage.copy_many([("container/dst", "container/src")], move=True)
+        self.assertEqual(read("container/src"), b"new")
+        with self.assertRaises(SelectelCDNApiException):
+            read("container/dst")
+
+    def test_storage_save_many(self):
+        storage = self.make_storage(use_gz=True)
+        files = dict(("container/thumbs/{}.txt".format(i), "file {}".format(i).encode("utf-8")) for i in range(50))
+        big_content = os.urandom(3 * 1024 * 1024)
+        files["other/big.bin"] = ContentFile(big_content)
+
+        with patch.dict(settings.SELECTEL_STORAGE, ARCHIVE_BATCH_SIZE=20, ARCHIVE_GZIP=True):
+            results = storage.save_many(files)
+
+        self.assertEqual(results, dict((name, 201) for name in files))
+        with storage.open("container/thumbs/7.txt") as fileobj:
+            self.assertEqual(fileobj.read(), b"file 7")
+        with storage.open("other/big.bin") as fileobj:
+            self.assertEqual(fileobj.read(), big_content)